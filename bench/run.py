@@ -0,0 +1,571 @@
+"""
+Offline benchmark of the scraping, conversion and publishing pipelines of main.py.
+- messes.info and levangileauquotidien.org are replaced by synthetic pages (bench/fixtures) on a local HTTP server:
+  hand-written imitations with the table / section structure main.py parses, placeholder navigation and repeated
+  filler, not recordings of the real sites, so parse timings only approximate real pages
+- Perplexity is replaced by a fake OpenAI-compatible endpoint on the same server
+- B2 is replaced by an in-memory bucket with a simulated per-upload latency
+- sample bulletins of increasing size and image count are generated in a scratch directory
+For every stage: wall time, CPU time (process and children), peak RSS (process and live children) and output
+bytes, compared with bench/baseline.json.
+
+    python bench/run.py                   # run all stages and compare with the baseline
+    python bench/run.py --only docx       # stages whose name contains 'docx'
+    python bench/run.py --save-baseline   # store the results as the new baseline (on the deploy machine)
+
+Exits with status 1 when a stage is slower or larger than the baseline beyond the tolerance.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import zipfile
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+# Simulated page-load time of the parish pages in the fan-out stages
+PAGE_LATENCY = 0.5
+# Stages missing from the committed bench/baseline.json, and why: they are run and reported, never regression-checked
+UNBASELINED = {
+    "readings_browser": "recorded without Chromium; run --save-baseline --only readings_browser where it is installed",
+}
+# A pipeline stage run in a gevent-patched interpreter (as under gunicorn's gevent worker) fails past this
+GEVENT_STAGE_TIMEOUT = 120
+# Noise floors under which a difference with the baseline is never reported
+MIN_DELTA_SECONDS = 0.005
+MIN_DELTA_CPU_SECONDS = 2 / CLOCK_TICKS  # live children are only accounted in clock ticks
+MIN_DELTA_MB = 10
+# (name, paragraphs, images, image size in px): the large one is a heavy month-end bulletin
+BULLETINS = [
+    ("small", 20, 2, (1200, 900)),
+    ("medium", 60, 8, (2400, 1600)),
+    ("large", 150, 24, (3000, 2000)),
+]
+
+
+##################################################################
+# LOCAL STAND-INS: FIXTURE PAGES AND OPENAI-COMPATIBLE ENDPOINT
+class FakeCompletions:
+    """Canned chat completions: a list of events, or an HTML table when the conversation asks for one."""
+    EVENTS = "\n".join(
+        f"- {day} juin 2026 : pèlerinage {i} à l'abbaye de Beaufort (Plerguer), départ de Saint Malo"
+        for i, day in enumerate(range(3, 28, 3), start=1))
+    TABLE = ("Voici le tableau demandé :\n\n<table>\n<tr><th>Date</th><th>Lieu</th><th>Description</th>"
+             "<th>Lien</th></tr>\n" + "".join(
+                 f"<tr><td>{day} juin 2026</td><td>Abbaye de Beaufort</td><td>Pèlerinage {i}</td>"
+                 f"<td><a href=\"https://example.org/{i}\">Cliquez ici</a></td></tr>\n"
+                 for i, day in enumerate(range(3, 28, 3), start=1)) + "</table>\n\n[1] Sources")
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def answer(self, payload):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        question = payload["messages"][-1]["content"]
+        content = self.TABLE if "table HTML" in question else self.EVENTS
+        prompt_tokens = sum(len(m["content"]) for m in payload["messages"]) // 4
+        return {
+            "id": f"bench-{self.calls}", "object": "chat.completion", "created": int(time.time()),
+            "model": payload.get("model", "bench"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                      "total_tokens": prompt_tokens + len(content) // 4},
+        }
+
+
+def start_local_server(completions):
+    """Serve bench/fixtures (GET) and the fake /v1/chat/completions (POST) on 127.0.0.1. Returns the base URL."""
+    class Handler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=FIXTURES_DIR, **kwargs)
+
+        def do_GET(self):
+            # ?delay=<seconds> simulates a slow remote page; the query string is otherwise ignored
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            if "delay" in query:
+                time.sleep(float(query["delay"][0]))
+            super().do_GET()
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            body = json.dumps(completions.answer(payload)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class FakeBucket:
+    """The subset of b2sdk's Bucket used by main.py, kept in memory, with `latency` seconds per upload."""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.files = {}
+        self.uploads = 0
+        self.bytes_uploaded = 0
+        self._lock = threading.Lock()
+
+    def _store(self, file_name, data):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.files[file_name] = data
+            self.uploads += 1
+            self.bytes_uploaded += len(data)
+
+    def upload_local_file(self, local_file, file_name, **kwargs):
+        with open(local_file, "rb") as f:
+            self._store(file_name, f.read())
+
+    def upload_bytes(self, data_bytes, file_name, content_type=None, file_infos=None, **kwargs):
+        self._store(file_name, data_bytes)
+
+    def get_file_info_by_name(self, file_name):
+        raise KeyError(file_name)
+
+    def get_download_url(self, file_name):
+        return f"https://bench.invalid/file/{file_name}"
+
+##################################################################
+# SAMPLE BULLETINS (MINIMAL .DOCX WITH CROPPED, SCALED PHOTOS)
+DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Default Extension="jpeg" ContentType="image/jpeg"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+DOCX_ROOT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+DOCX_PARAGRAPH = ('<w:p><w:pPr><w:pStyle w:val="{style}"/></w:pPr><w:r><w:t xml:space="preserve">{text}</w:t>'
+                  '</w:r></w:p>')
+DOCX_PICTURE = (
+    '<w:p><w:r><w:drawing><wp:inline><wp:extent cx="{cx}" cy="{cy}"/><wp:docPr id="{n}" name="Image {n}"/>'
+    '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture"><pic:pic>'
+    '<pic:nvPicPr><pic:cNvPr id="{n}" name="image{n}.jpeg"/><pic:cNvPicPr/></pic:nvPicPr>'
+    '<pic:blipFill><a:blip r:embed="rIdImg{n}"/><a:srcRect l="{l}" t="{t}" r="{r}" b="{b}"/>'
+    '<a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm><a:prstGeom prst="rect"/>'
+    '</pic:spPr></pic:pic></a:graphicData></a:graphic></wp:inline></w:drawing></w:r></w:p>')
+DOCX_TEXT = ("Dimanche, la messe sera célébrée à Saint Méloir à 10h30, suivie du verre de l'amitié. "
+             "Les inscriptions pour le pèlerinage au Mont Saint Michel sont ouvertes au presbytère. ")
+
+
+def sample_photo(size, rng):
+    from PIL import Image
+    # Noise over a gradient: compresses like a photograph, unlike a flat test card
+    noise = [Image.effect_noise(size, rng.randint(20, 60)) for _ in range(2)]
+    gradient = Image.linear_gradient("L").resize(size)
+    out = io.BytesIO()
+    Image.merge("RGB", (noise[0], gradient, noise[1])).save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def write_sample_bulletin(path, paragraphs, images, size, seed=0):
+    rng = random.Random(seed)
+    body, rels = [], []
+    for i in range(paragraphs):
+        style = "Heading1" if i % 10 == 0 else "Normal"
+        body.append(DOCX_PARAGRAPH.format(style=style, text=f"{i + 1}. " + DOCX_TEXT * rng.randint(1, 4)))
+        if images and i % max(1, paragraphs // images) == 0 and len(rels) < images:
+            n = len(rels) + 1
+            cx = rng.choice((2, 3, 6)) * 914400  # 2, 3 or 6 inches wide on the page
+            body.append(DOCX_PICTURE.format(n=n, cx=cx, cy=cx * size[1] // size[0], l=rng.randint(0, 15000),
+                                            t=rng.randint(0, 15000), r=rng.randint(0, 15000),
+                                            b=rng.randint(0, 15000)))
+            rels.append(n)
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+        'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+        'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+        'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+        f'<w:body>{"".join(body)}</w:body></w:document>')
+    document_rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">' + "".join(
+            f'<Relationship Id="rIdImg{n}" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+            f'relationships/image" Target="media/image{n}.jpeg"/>' for n in rels) + '</Relationships>')
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", DOCX_CONTENT_TYPES)
+        z.writestr("_rels/.rels", DOCX_ROOT_RELS)
+        z.writestr("word/document.xml", document)
+        z.writestr("word/_rels/document.xml.rels", document_rels)
+        for n in rels:
+            z.writestr(f"word/media/image{n}.jpeg", sample_photo(size, rng), compress_type=zipfile.ZIP_STORED)
+    return path
+
+##################################################################
+# GEVENT-PATCHED INTERPRETER (render.yaml runs gunicorn with the gevent worker)
+GEVENT_DOCX_SCRIPT = """
+from gevent import monkey; monkey.patch_all()
+import contextlib, json, os, sys, time
+sys.path[:0] = [sys.argv[1], os.path.join(sys.argv[1], "bench")]
+import main
+from run import FakeBucket
+main.b2_state.update(bucket=FakeBucket(), authorized_at=time.time())
+main.IMAGE_POOL_WORKERS, main.IMAGE_POOL_MIN_IMAGES = max(2, os.cpu_count() or 1), 1
+main.IMAGE_POOL_WINDOW = 2 * main.IMAGE_POOL_WORKERS
+output = main.process_word_file(sys.argv[2], "bench_gevent", lambda step: contextlib.nullcontext(), image_mode="inline")
+print(json.dumps({"html_bytes": os.path.getsize(output["html"]), "images": output["images"]}))
+"""
+
+
+def run_gevent_docx(path, timeout=GEVENT_STAGE_TIMEOUT):
+    """Convert a bulletin in a fresh gevent-patched interpreter, with the image pool forced on. Returns the HTML bytes."""
+    try:
+        completed = subprocess.run([sys.executable, "-c", GEVENT_DOCX_SCRIPT, REPO_DIR, path], capture_output=True,
+                                   text=True, timeout=timeout, env=os.environ)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"conversion under gevent still running after {timeout}s (image pool deadlock?)")
+    if completed.returncode != 0:
+        raise RuntimeError(f"conversion under gevent failed: {completed.stderr.strip().splitlines()[-1:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])["html_bytes"]
+
+##################################################################
+# MEASUREMENT: WALL, CPU (WITH CHILDREN), PEAK RSS (WITH LIVE CHILDREN)
+def descendant_pids(root_pid):
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+        except OSError:
+            continue
+    found, todo = [], [root_pid]
+    while todo:
+        pid = todo.pop()
+        children = [child for child, parent in parents.items() if parent == pid]
+        found.extend(children)
+        todo.extend(children)
+    return found
+
+
+def cpu_seconds():
+    """CPU of this process, of reaped children and of live descendants (image pool workers, Chromium)."""
+    # getrusage has microsecond resolution (os.times() counts clock ticks)
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    reaped = resource.getrusage(resource.RUSAGE_CHILDREN)
+    total = own.ru_utime + own.ru_stime + reaped.ru_utime + reaped.ru_stime
+    for pid in descendant_pids(os.getpid()):
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        except OSError:
+            continue
+    return total
+
+
+def reset_peak_rss(pids):
+    # Writing 5 to clear_refs resets VmHWM (Linux >= 4.0); without it the peak is the process-lifetime peak
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+
+def peak_rss_mb(pids):
+    total_kb = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status", "r") as f:
+                total_kb += next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+        except (OSError, StopIteration):
+            if pid == os.getpid():
+                total_kb += resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(total_kb / 1024, 1)
+
+
+def measure(fn, repeat):
+    """Run fn() `repeat` times. Returns median wall / CPU seconds, the highest peak RSS and fn's output bytes."""
+    walls, cpus, peaks, output = [], [], [], 0
+    for _ in range(repeat):
+        pids = [os.getpid()] + descendant_pids(os.getpid())
+        reset_peak_rss(pids)
+        cpu_start, start = cpu_seconds(), time.perf_counter()
+        output = fn()
+        walls.append(time.perf_counter() - start)
+        cpus.append(cpu_seconds() - cpu_start)
+        peaks.append(peak_rss_mb([os.getpid()] + descendant_pids(os.getpid())))
+    return {"wall_s": round(statistics.median(walls), 4), "cpu_s": round(statistics.median(cpus), 4),
+            "peak_rss_mb": max(peaks), "output_bytes": output, "runs": repeat}
+
+##################################################################
+# STAGES
+def build_stages(main, base_url, bucket, completions, scratch):
+    """Return [(name, fn)]: each fn runs one stage against the stand-ins and returns the bytes it produced."""
+    fixtures = {name: open(os.path.join(FIXTURES_DIR, name), "rb").read()
+                for name in ("schedule_1m.html", "schedule_6m.html")}
+
+    def schedule_parse(name):
+        return lambda: len(json.dumps(main.schedule_table_rows(fixtures[name]), ensure_ascii=False).encode("utf-8"))
+
+    def bench_parish(key, url):
+        main.SCHEDULE_PARISHES[key] = {"name": key, "url": url, "churches": main.SCHEDULE_CHURCHES,
+                                       "b2_name": f"bench/{key}.json", "path": f"static/schedule_{key}.json"}
+        return key
+
+    def schedule_http(name):
+        parish = bench_parish(f"bench-{name}", f"{base_url}/{name}")
+
+        def run():
+            rows = main.run_async(main.fetch_and_clean_schedule("http", None, parish))
+            return len(json.dumps(rows, ensure_ascii=False).encode("utf-8"))
+        return run
+
+    def schedule_parishes(count, concurrent):
+        parishes = [bench_parish(f"bench-parish-{i}", f"{base_url}/schedule_1m.html?delay={PAGE_LATENCY}")
+                    for i in range(count)]
+
+        def run():
+            # A full bucket, as for a refresh hours after the previous one
+            main.schedule_rate_limiter = main.RateLimiter(main.SCHEDULE_RATE_PER_SECOND, main.SCHEDULE_CONCURRENCY)
+            if concurrent:
+                results = main.run_async(main.fetch_all_schedules(parishes, "http"))
+            else:
+                results = {parish: main.run_async(main.fetch_and_clean_schedule("http", None, parish))
+                           for parish in parishes}
+            if any(isinstance(rows, Exception) for rows in results.values()):
+                raise RuntimeError(f"parish scrape failed: {results}")
+            return len(json.dumps(results, ensure_ascii=False).encode("utf-8"))
+        return run
+
+    def schedule_query():
+        parish = bench_parish("bench-store", f"{base_url}/schedule_6m.html")
+        if not main.schedule_store.count(parish):
+            main.schedule_store.replace(parish, main.schedule_table_rows(fixtures["schedule_6m.html"]))
+        # What the website asks for: one week, and the next masses of one church
+        rows = main.schedule_store.query(parish, start="2026-03-01", end="2026-03-07")
+        rows += main.schedule_store.query(parish, ou="Saint Méloir", limit=10)
+        return len(json.dumps(rows, ensure_ascii=False).encode("utf-8"))
+
+    def readings_browser():
+        sections = main.run_async(main.readings_extract_all_sections(f"{base_url}/readings.html"))
+        if sections is None:
+            raise RuntimeError("readings scrape failed (is Chromium installed? playwright install chromium)")
+        return len(json.dumps(sections, ensure_ascii=False).encode("utf-8"))
+
+    @contextlib.contextmanager
+    def forced_image_pool():
+        # The pool is skipped on 1-CPU machines and for few images: force it on, with at least 2 workers
+        saved = main.IMAGE_POOL_WORKERS, main.IMAGE_POOL_MIN_IMAGES, main.IMAGE_POOL_WINDOW
+        main.IMAGE_POOL_WORKERS = max(2, os.cpu_count() or 1)
+        main.IMAGE_POOL_MIN_IMAGES = 1
+        main.IMAGE_POOL_WINDOW = 2 * main.IMAGE_POOL_WORKERS
+        try:
+            yield
+        finally:
+            main.IMAGE_POOL_WORKERS, main.IMAGE_POOL_MIN_IMAGES, main.IMAGE_POOL_WINDOW = saved
+
+    def docx(name, image_mode, pool=False):
+        path = os.path.join(scratch, f"bulletin_{name}.docx")
+
+        def run():
+            timestamp = f"bench_{name}_{image_mode}"
+            with forced_image_pool() if pool else contextlib.nullcontext():
+                output = main.process_word_file(path, timestamp, lambda step: contextlib.nullcontext(),
+                                                image_mode=image_mode)
+            if pool and output["images"]["pooled"] == 0:
+                raise RuntimeError(f"image pool not used: {output['images']}")
+            return os.path.getsize(output["html"])
+        return run
+
+    def docx_gevent(name):
+        path = os.path.join(scratch, f"bulletin_{name}.docx")
+        return lambda: run_gevent_docx(path)
+
+    def b2_batch():
+        files = []
+        for i in range(12):
+            path = os.path.join(scratch, f"b2_batch_{i}.html")
+            if not os.path.exists(path):
+                with open(path, "wb") as f:
+                    f.write(random.Random(i).randbytes(64 * 1024))
+            files.append((path, f"bench/batch_{i}.html"))
+        before = bucket.bytes_uploaded
+        reports = main.push_b2_files(files, dedupe=False)
+        if any(r["error"] for r in reports):
+            raise RuntimeError(f"B2 batch upload failed: {[r['error'] for r in reports if r['error']]}")
+        return bucket.bytes_uploaded - before
+
+    def perplexity():
+        main.PERPLEXITY_BASE_URL = f"{base_url}/v1"
+        return len(main.get_perplexity_events(use_cache=False).encode("utf-8"))
+
+    stages = [
+        ("schedule_parse_1m", schedule_parse("schedule_1m.html")),
+        ("schedule_parse_6m", schedule_parse("schedule_6m.html")),
+        ("schedule_http_6m", schedule_http("schedule_6m.html")),
+        ("schedule_serial_3", schedule_parishes(3, concurrent=False)),
+        ("schedule_fanout_3", schedule_parishes(3, concurrent=True)),
+        ("schedule_query", schedule_query),
+        ("readings_browser", readings_browser),
+    ]
+    for name, _, _, _ in BULLETINS:
+        stages.append((f"docx_{name}", docx(name, "inline")))
+    stages += [
+        ("docx_large_hosted", docx("large", "hosted")),
+        ("docx_large_pool", docx("large", "inline", pool=True)),
+        ("docx_medium_gevent", docx_gevent("medium")),
+        ("b2_batch_12", b2_batch),
+        ("perplexity_events", perplexity),
+    ]
+    return stages
+
+##################################################################
+# BASELINE COMPARISON
+def compare(results, baseline, tolerance):
+    """Return (lines, regressions) comparing each stage with its baseline entry."""
+    lines, regressions = [], []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or "error" in result or "error" in base:
+            if base is None:
+                lines.append(f"{name}: not baselined ({UNBASELINED[name]})" if name in UNBASELINED
+                             else f"{name}: no baseline")
+            else:
+                lines.append(f"{name}: not comparable")
+            continue
+        notes = []
+        for key, floor in (("wall_s", MIN_DELTA_SECONDS), ("cpu_s", MIN_DELTA_CPU_SECONDS),
+                           ("peak_rss_mb", MIN_DELTA_MB)):
+            delta = result[key] - base[key]
+            ratio = result[key] / base[key] if base[key] else float("inf")
+            if delta > floor and ratio > 1 + tolerance:
+                regressions.append(f"{name} {key} {base[key]} -> {result[key]} (x{ratio:.2f})")
+                notes.append(f"{key} x{ratio:.2f} REGRESSION")
+            elif -delta > floor and ratio < 1 - tolerance:
+                notes.append(f"{key} x{ratio:.2f} faster" if key != "peak_rss_mb" else f"{key} x{ratio:.2f} smaller")
+        if result["output_bytes"] != base["output_bytes"]:
+            notes.append(f"output {base['output_bytes']} -> {result['output_bytes']} bytes")
+        lines.append(f"{name}: {', '.join(notes) or 'within tolerance'}")
+    return lines, regressions
+
+
+def print_table(results):
+    print(f"{'stage':<22}{'wall ms':>10}{'cpu ms':>10}{'peak MB':>10}{'output bytes':>14}")
+    for name, r in results.items():
+        if "error" in r:
+            print(f"{name:<22}  skipped: {r['error']}")
+            continue
+        print(f"{name:<22}{1000 * r['wall_s']:>10.1f}{1000 * r['cpu_s']:>10.1f}{r['peak_rss_mb']:>10.1f}"
+              f"{r['output_bytes']:>14}")
+
+##################################################################
+# MAIN
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline benchmark of main.py against local stand-ins")
+    parser.add_argument("--only", action="append", help="run stages whose name contains this (repeatable)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the median is reported")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown / growth vs the baseline")
+    parser.add_argument("--b2-latency", type=float, default=0.05, help="simulated seconds per B2 upload")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated seconds per completion")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    completions = FakeCompletions(args.llm_latency)
+    base_url = start_local_server(completions)
+    scratch = tempfile.mkdtemp(prefix="mass-schedule-bench-")
+    for name, paragraphs, images, size in BULLETINS:
+        write_sample_bulletin(os.path.join(scratch, f"bulletin_{name}.docx"), paragraphs, images, size,
+                              seed=len(name))
+
+    # main.py works relative to the current directory and reads its configuration at import time
+    os.chdir(scratch)
+    os.environ.update({"SCHEDULER_ENABLED": "0", "B2_VERIFY_REMOTE": "0", "PERPLEXITY_KEY": "bench",
+                       "PERPLEXITY_BASE_URL": f"{base_url}/v1"})
+    sys.path.insert(0, REPO_DIR)
+    import main
+    logging.getLogger().setLevel(logging.WARNING)
+    main.READINGS_SITE = "127.0.0.1"  # the fixture's own stylesheet is not third-party
+    bucket = FakeBucket(args.b2_latency)
+    main.b2_state.update(bucket=bucket, authorized_at=time.time())
+
+    results = {}
+    for name, fn in build_stages(main, base_url, bucket, completions, scratch):
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        try:
+            fn()  # warm-up: imports, pools, browser launch and connections are not what we measure
+            results[name] = measure(fn, args.repeat)
+        except Exception as e:
+            results[name] = {"error": str(e)}
+        print(f"{name}: {results[name]}", file=sys.stderr)
+
+    print_table(results)
+    report = {"meta": {"python": platform.python_version(), "machine": platform.machine(),
+                       "cpus": os.cpu_count(), "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "repeat": args.repeat, "b2_latency": args.b2_latency, "llm_latency": args.llm_latency},
+              "stages": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+
+    status = 0
+    if args.save_baseline:
+        baseline = {"meta": report["meta"], "stages": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline["stages"] = json.load(f).get("stages", {})
+        baseline["stages"].update({name: r for name, r in results.items() if "error" not in r})
+        tmp_path = args.baseline + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline["stages"], args.tolerance)
+        print(f"\nCompared with the baseline of {baseline['meta']['date']} "
+              f"(python {baseline['meta']['python']}, {baseline['meta']['cpus']} CPUs):")
+        print("\n".join(lines))
+        if regressions:
+            print(f"\n{len(regressions)} regression(s):\n" + "\n".join(regressions))
+            status = 1
+    else:
+        print(f"No baseline at {args.baseline}: run with --save-baseline to create one")
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,76 @@
+# Image crop / downscale / re-encode for bulletin images, shared by main.py and its image pool workers.
+# Kept apart from main.py so pool workers import only this module: no Flask app, threads or files at import.
+import io
+import os
+from PIL import Image
+
+##################################################################
+# DISPLAY-SIZE OPTIMISATION OF BULLETIN IMAGES
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(40 * 1000 * 1000)))  # larger images are not decoded
+IMAGE_OPTIMIZE = os.getenv("IMAGE_OPTIMIZE", "1") == "1"
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "WEBP").upper()  # WEBP or JPEG for photos; line art stays PNG
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_DISPLAY_MAX_WIDTH = 800  # CSS px, body max-width of the bulletin HTML
+IMAGE_HIDPI_SCALE = float(os.getenv("IMAGE_HIDPI_SCALE", "2"))
+EMU_PER_PX = 9525  # 914400 EMU per inch at 96 px per inch
+
+
+def image_target_width(extent):
+    """Pixel width worth keeping for an image rendered `extent` EMU wide, or None if unknown."""
+    if not IMAGE_OPTIMIZE or extent is None or extent[0] <= 0:
+        return None
+    display_width = min(extent[0] / EMU_PER_PX, IMAGE_DISPLAY_MAX_WIDTH)
+    return max(1, int(display_width * IMAGE_HIDPI_SCALE))
+
+
+def image_is_line_art(img):
+    # Bilevel and palette images are drawings; greyscale ("L") is not enough, scanned and B&W photos are greyscale
+    if img.mode in ("1", "P", "PA"):
+        return True
+    return img.format in ("PNG", "GIF", "BMP", "TIFF") and img.getcolors(256) is not None
+
+
+def process_image(data, layout):
+    """
+    Crop, downscale and re-encode one image according to its layout entry.
+    Returns (bytes, content type or None if unchanged, decoded). Runs in main.py or in an image pool worker.
+    """
+    crop = layout["crop"]
+    target_width = image_target_width(layout["extent"])
+    if crop is None and target_width is None:
+        return data, None, False
+    img = Image.open(io.BytesIO(data))
+    fmt = img.format
+    if img.width * img.height > IMAGE_MAX_PIXELS:
+        return data, None, False
+    crop_l, crop_t, crop_r, crop_b = crop or (0, 0, 0, 0)
+    if target_width is not None and fmt == "JPEG":
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when the kept area is still wider than needed
+        keep = max(1 - (crop_l + crop_r) / 100000, 0.01)
+        img.draft("RGB", (int(target_width / keep), int(target_width / keep * img.height / img.width)))
+    line_art = IMAGE_OPTIMIZE and image_is_line_art(img)
+    has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+    img = img.convert("RGBA" if line_art and has_alpha else "RGB")
+    width_px, height_px = img.size
+    crop_x1 = int(crop_l*width_px/100000)
+    crop_y1 = int(crop_t*height_px/100000)
+    crop_x2 = int((1-crop_r/100000)*width_px)
+    crop_y2 = int((1-crop_b/100000)*height_px)
+    cropped = img.crop((crop_x1, crop_y1, crop_x2, crop_y2)) if crop is not None else img
+    if target_width is not None and cropped.width > target_width:
+        target_height = max(1, round(cropped.height * target_width / cropped.width))
+        cropped = cropped.resize((target_width, target_height), Image.LANCZOS)
+
+    out = io.BytesIO()
+    if not IMAGE_OPTIMIZE:
+        out_fmt = fmt
+        cropped.save(out, format=out_fmt)
+    elif line_art:
+        out_fmt = "PNG"
+        cropped.save(out, format=out_fmt, optimize=True)
+    else:
+        out_fmt = IMAGE_FORMAT
+        cropped.save(out, format=out_fmt, quality=IMAGE_QUALITY, optimize=True)
+    if crop is None and cropped.size == (width_px, height_px) and out.tell() >= len(data):
+        return data, None, True  # Nothing cropped or resized and no smaller: keep the original bytes
+    return out.getvalue(), Image.MIME.get(out_fmt), True
@@ -1,34 +1,57 @@
-from flask import Flask, jsonify, request, send_file, Response, send_file
-from bs4 import BeautifulSoup
-import io
-import nest_asyncio
+from flask import Flask, jsonify, request, send_file, Response, send_file, g
+import _thread
 import asyncio
+from contextlib import asynccontextmanager, contextmanager
 import zipfile
 from playwright.async_api import async_playwright
 import json
 import os
+import sqlite3
 import base64
+import hashlib
+import re
 from datetime import date, datetime, timedelta
 from flask_cors import CORS
 import mammoth
 from pathlib import Path
 import zipfile
-import io
 from lxml import etree
 from PIL import Image
-import tempfile
+from imaging import process_image
+import shutil
 from b2sdk.v2 import InMemoryAccountInfo, B2Api
+from b2sdk.v2.exception import InvalidAuthToken, Unauthorized
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from collections import OrderedDict, deque
 import locale
 import logging
+import logging.handlers
+import gzip
+import atexit
 import pytz
-import schedule
+import requests
+from urllib.parse import urlsplit
+import fcntl
+import random
+import signal
+import sys
+import bisect
 import threading
 import time
 from openai import OpenAI
+try:
+    import brotli
+except ImportError:  # Optional: only gzip variants are published without it
+    brotli = None
 
 
 ##################################################################
 # APP INITIALISATION
+# `python main.py` runs this file as __main__, so image pool workers (forkserver / spawn) import it again as
+# __mp_main__ before unpickling their task: they get the definitions, not the job workers or the scheduler
+BACKGROUND_WORK = __name__ != "__mp_main__"
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10 MB
 HTML_FILE_PATH = "latest.html"
@@ -48,33 +71,788 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 if not os.path.exists(UPLOAD_LOG_FILE):
     with open(UPLOAD_LOG_FILE, "w", encoding="utf-8") as log:
         log.write("[INIT] Created log file\n")
-nest_asyncio.apply()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+
+
+def write_json_atomic(path, data, indent=1):
+    """Write data as UTF-8 JSON to path.tmp and rename it over path, so readers never see a partial file."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp_path, path)
+
+
+def gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def rotate_log_file(path, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """
+    Shift path.1.gz ... path.N.gz and gzip the current file into path.1.gz once it passes max_bytes.
+    Workers sharing the file take turns on a lockf of path.lock (also held by UploadLog while writing); the one
+    that comes second finds the file small again (or already gone) and leaves it alone.
+    """
+    with open(path + ".lock", "a") as lock_file:
+        fcntl.lockf(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.path.getsize(path) < max_bytes:
+                return False
+            for i in range(backup_count - 1, 0, -1):
+                if os.path.exists(f"{path}.{i}.gz"):
+                    os.replace(f"{path}.{i}.gz", f"{path}.{i + 1}.gz")
+            gzip_rotator(path, f"{path}.1.gz")
+        except FileNotFoundError:
+            return False
+        return True
+
+
+app_log_handler = logging.handlers.RotatingFileHandler("log.txt", maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+app_log_handler.namer = lambda name: name + ".gz"
+app_log_handler.rotator = gzip_rotator
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s",
     handlers=[
         logging.StreamHandler(),  # Console (Render logs)
-        logging.FileHandler("log.txt")  # Optional: file in your container
+        app_log_handler  # Optional: file in your container, rotated into log.txt.N.gz
     ]
 )
 ##################################################################
-# CONNECT TO BLACKBLAZE
-def get_b2_bucket():
-    b2_info = InMemoryAccountInfo()
-    b2_api = B2Api(b2_info)
-    b2_application_key_id = os.getenv("B2_KEY_ID")
-    b2_application_key = os.getenv("B2_APPLICATION_KEY")
-    b2_api.authorize_account("production", b2_application_key_id, b2_application_key)
-    return b2_api.get_bucket_by_name("MeloirFiles")
+# CONNECT TO BLACKBLAZE (ONE AUTHORIZED HANDLE PER PROCESS)
+B2_BUCKET_NAME = "MeloirFiles"
+B2_AUTH_MAX_AGE = 23 * 60 * 60  # B2 tokens are valid 24h: re-authorize before expiry
+B2_UPLOAD_WORKERS = int(os.getenv("B2_UPLOAD_WORKERS", "4"))
+b2_lock = threading.Lock()
+b2_state = {"bucket": None, "authorized_at": 0.0, "authorizations": 0}
+
+
+def get_b2_bucket(force_reauth=False):
+    with b2_lock:
+        expired = time.time() - b2_state["authorized_at"] > B2_AUTH_MAX_AGE
+        if force_reauth or expired or b2_state["bucket"] is None:
+            b2_info = InMemoryAccountInfo()
+            b2_api = B2Api(b2_info)
+            b2_application_key_id = os.getenv("B2_KEY_ID")
+            b2_application_key = os.getenv("B2_APPLICATION_KEY")
+            b2_api.authorize_account("production", b2_application_key_id, b2_application_key)
+            b2_state["bucket"] = b2_api.get_bucket_by_name(B2_BUCKET_NAME)
+            b2_state["authorized_at"] = time.time()
+            b2_state["authorizations"] += 1
+            logging.info(f"B2 account authorized (#{b2_state['authorizations']})")
+        return b2_state["bucket"]
+
+
+def with_b2_bucket(action):
+    """Return action(bucket), authorizing again and retrying once if the token was revoked or expired early."""
+    try:
+        return action(get_b2_bucket())
+    except (InvalidAuthToken, Unauthorized):
+        return action(get_b2_bucket(force_reauth=True))
 
 ##################################################################
 # UPLOAD FILE TO BLACKBLAZE
 def push_b2_file(file_local, file_server):
-    bucket = get_b2_bucket()
-    bucket.upload_local_file(
-        local_file=file_local,
-        file_name=file_server
-    )
+    with metrics.time("b2_upload"):
+        with_b2_bucket(lambda bucket: bucket.upload_local_file(local_file=file_local, file_name=file_server))
+
+##################################################################
+# PUBLISH TO BLACKBLAZE ONLY WHEN THE CONTENT CHANGED
+B2_MANIFEST_PATH = "b2_manifest.json"
+B2_ALWAYS_PUBLISH = {"heartbeat.txt", "horaires_messes_MAJ.txt", "evenements_MAJ.txt"}
+B2_VERIFY_REMOTE = os.getenv("B2_VERIFY_REMOTE", "1") == "1"
+# Our own "Mis à jour le ..." stamp changes on every run and must not count as a content change
+TIME_STAMP_PATTERN = re.compile(rb"<br><small>Mis \xc3\xa0 jour le [^<]*</small>")
+
+
+class PublishManifest:
+    """
+    Content hashes of what was last published under each remote name, persisted in b2_manifest.json:
+    {remote: {"sha1": raw bytes SHA1 (as B2 contentSha1), "fingerprint": SHA1 without time stamp, "size"}}
+    """
+    def __init__(self, path=B2_MANIFEST_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.uploaded = 0
+        self.skipped = 0
+        self.bytes_saved = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def hashes(file_local):
+        with open(file_local, "rb") as f:
+            content = f.read()
+        return (hashlib.sha1(content).hexdigest(),
+                hashlib.sha1(TIME_STAMP_PATTERN.sub(b"", content)).hexdigest(),
+                len(content))
+
+    def unchanged(self, file_server, sha1, fingerprint):
+        entry = self.entries.get(file_server)
+        if entry is not None:
+            return entry["fingerprint"] == fingerprint
+        if not B2_VERIFY_REMOTE:
+            return False
+        # Nothing known locally (fresh container): compare with what B2 already holds
+        try:
+            remote_sha1 = get_b2_bucket().get_file_info_by_name(file_server).content_sha1
+        except Exception:
+            return False
+        return remote_sha1 == sha1
+
+    def record(self, file_server, sha1, fingerprint, size):
+        with self._lock:
+            self.entries[file_server] = {"sha1": sha1, "fingerprint": fingerprint, "size": size}
+            write_json_atomic(self.path, self.entries)
+
+    def stats(self):
+        return {"uploaded": self.uploaded, "skipped": self.skipped, "bytes_saved": self.bytes_saved,
+                "entries": len(self.entries)}
+
+
+b2_manifest = PublishManifest()
+
+
+def publish_b2_file(file_local, file_server, force=False):
+    """push_b2_file() unless the same content was already published under that name. Returns True if uploaded."""
+    sha1, fingerprint, size = PublishManifest.hashes(file_local)
+    if not force and file_server not in B2_ALWAYS_PUBLISH and b2_manifest.unchanged(file_server, sha1, fingerprint):
+        b2_manifest.skipped += 1
+        b2_manifest.bytes_saved += size
+        metrics.inc("b2_uploads_skipped_total")
+        metrics.inc("b2_bytes_saved_total", size)
+        if file_server not in b2_manifest.entries:
+            b2_manifest.record(file_server, sha1, fingerprint, size)
+        return False
+    push_b2_file(file_local, file_server)
+    b2_manifest.uploaded += 1
+    metrics.inc("b2_uploads_total")
+    b2_manifest.record(file_server, sha1, fingerprint, size)
+    return True
+
+##################################################################
+# UPLOAD A BATCH OF FILES TO BLACKBLAZE IN PARALLEL
+b2_upload_executor = ThreadPoolExecutor(max_workers=B2_UPLOAD_WORKERS, thread_name_prefix="b2-upload")
+
+
+def push_b2_files(files, dedupe=True):
+    """
+    Upload (file_local, file_server) pairs concurrently on the shared upload pool.
+    With dedupe, files whose content is unchanged since the last publish are skipped.
+    Returns one report per file: {"local", "remote", "seconds", "skipped", "error"} (error is None on success).
+    """
+    def upload(file_local, file_server):
+        start = time.perf_counter()
+        error, skipped = None, False
+        try:
+            if dedupe:
+                skipped = not publish_b2_file(file_local, file_server)
+            else:
+                push_b2_file(file_local, file_server)
+        except Exception as e:
+            error = str(e)
+            logging.info(f"B2 upload of {file_local} as {file_server} failed {error}")
+        return {"local": file_local, "remote": file_server,
+                "seconds": round(time.perf_counter() - start, 3), "skipped": skipped, "error": error}
+
+    get_b2_bucket()  # authorize once up front rather than racing in every worker
+    futures = [b2_upload_executor.submit(upload, local, remote) for local, remote in files]
+    reports = [future.result() for future in futures]
+    failed = sum(r["error"] is not None for r in reports)
+    skipped = sum(r["skipped"] for r in reports)
+    logging.info(f"B2 batch upload: {len(reports) - failed - skipped} uploaded, {skipped} skipped (unchanged), "
+                 f"{failed} failed in {max([r['seconds'] for r in reports], default=0)} s "
+                 f"(total since start: {b2_manifest.uploaded} uploaded, {b2_manifest.skipped} skipped, "
+                 f"{b2_manifest.bytes_saved} bytes saved)")
+    return reports
+
+##################################################################
+# CONTENT-ADDRESSED IMAGE HOSTING ON BLACKBLAZE
+IMAGE_MODES = ("inline", "hosted")
+IMAGE_MODE = os.getenv("IMAGE_MODE", "inline")
+IMAGE_PREFIX = "images/"
+IMAGE_BASE_URL = os.getenv("IMAGE_BASE_URL")  # e.g. a CDN in front of the bucket; B2 download URL otherwise
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def push_b2_bytes(data, file_server, content_type, file_infos=None):
+    with metrics.time("b2_upload"):
+        with_b2_bucket(lambda bucket: bucket.upload_bytes(data, file_server, content_type=content_type,
+                                                          file_infos=file_infos))
+
+
+class HostedImages:
+    """
+    Images of one conversion published on B2 as images/<sha1>.<ext> and referenced by URL.
+    The name only depends on the content, so the URL is known before the upload finishes and
+    can be cached forever; hashes already published (manifest or B2 contentSha1) are not sent again.
+    Uploads run on the shared B2 pool; wait() reports the ones that failed so they can be inlined instead.
+    """
+    def __init__(self):
+        self._pending = {}
+        self.uploaded = 0
+        self.skipped = 0
+
+    def _upload(self, data, file_server, content_type, sha1):
+        if b2_manifest.unchanged(file_server, sha1, sha1):
+            self.skipped += 1
+            if file_server not in b2_manifest.entries:
+                b2_manifest.record(file_server, sha1, sha1, len(data))
+            return
+        push_b2_bytes(data, file_server, content_type, {"b2-cache-control": IMAGE_CACHE_CONTROL})
+        self.uploaded += 1
+        b2_manifest.record(file_server, sha1, sha1, len(data))
+
+    def url(self, data, content_type):
+        sha1 = hashlib.sha1(data).hexdigest()
+        ext = (content_type or "").split("/")[-1] or "bin"
+        file_server = f"{IMAGE_PREFIX}{sha1}.{ext}"
+        if IMAGE_BASE_URL:
+            url = f"{IMAGE_BASE_URL.rstrip('/')}/{file_server}"
+        else:
+            url = get_b2_bucket().get_download_url(file_server)
+        if url not in self._pending:
+            future = b2_upload_executor.submit(self._upload, data, file_server, content_type, sha1)
+            self._pending[url] = (future, data, content_type)
+        return url
+
+    def wait(self):
+        """Wait for all uploads; return {url: (data, content type)} for those that failed."""
+        failed = {}
+        for url, (future, data, content_type) in self._pending.items():
+            try:
+                future.result()
+            except Exception as e:
+                logging.info(f"B2 image upload {url} failed {str(e)}")
+                failed[url] = (data, content_type)
+        return failed
+
+##################################################################
+# SHARED HTTP SESSION (KEEP-ALIVE CONNECTION POOL)
+http_session = requests.Session()
+http_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8))
+http_session.headers.update({
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Accept-Language": "fr-FR,fr;q=0.9",
+})
+
+##################################################################
+# SHARED CHROMIUM POOL FOR PLAYWRIGHT SCRAPES
+BROWSER_POOL_MAX_CONTEXTS = int(os.getenv("BROWSER_POOL_MAX_CONTEXTS", "2"))
+BROWSER_POOL_MAX_USES = int(os.getenv("BROWSER_POOL_MAX_USES", "50"))
+BROWSER_POOL_MAX_RSS_MB = int(os.getenv("BROWSER_POOL_MAX_RSS_MB", "600"))  # Playwright driver + Chromium
+
+
+def process_tree_rss_mb(root_pid=None):
+    """Resident memory (MB) of a process and all its descendants, read from /proc."""
+    root_pid = root_pid or os.getpid()
+    children, rss_pages = {}, {}
+    try:
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "r") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            children.setdefault(int(fields[1]), []).append(int(entry))
+            rss_pages[int(entry)] = int(fields[21])
+    except OSError:
+        return 0.0
+    total, todo = 0, [root_pid]
+    while todo:
+        pid = todo.pop()
+        total += rss_pages.get(pid, 0)
+        todo.extend(children.get(pid, []))
+    return total * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def playwright_driver_pids():
+    """Children of this process running the Playwright driver, the parent of Chromium and its renderers."""
+    pids = []
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return pids
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            if ppid != os.getpid():
+                continue
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read().split(b"\0")
+        except OSError:
+            continue
+        if b"run-driver" in cmdline:
+            pids.append(int(entry))
+    return pids
+
+
+class BrowserPool:
+    """
+    Process-wide Chromium instance handing out one fresh BrowserContext per job.
+    - at most `max_contexts` contexts are open at the same time
+    - the browser is recycled after `max_uses` contexts or when the RSS of the Playwright driver and Chromium
+      (not of this worker and its image pool) passes `max_rss_mb`
+    - a crashed / disconnected browser is relaunched on the next acquire
+    """
+    def __init__(self, max_contexts=BROWSER_POOL_MAX_CONTEXTS, max_uses=BROWSER_POOL_MAX_USES,
+                 max_rss_mb=BROWSER_POOL_MAX_RSS_MB):
+        self.max_contexts = max_contexts
+        self.max_uses = max_uses
+        self.max_rss_mb = max_rss_mb
+        self._loop = None
+        self._playwright = None
+        self._browser = None
+        self._semaphore = None
+        self._launch_lock = None
+        self._uses = 0
+        self._recycle_pending = False
+        self.launches = 0
+        self.crashes = 0
+        self.recycles = 0
+        self.in_use = 0
+        self.acquired = 0
+        self.acquire_wait_total = 0.0
+
+    def _bind_loop(self):
+        # Playwright objects and asyncio primitives belong to one event loop:
+        # start over if we are now called from a different one
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._release(self._loop, self._browser, self._playwright)
+            self._loop = loop
+            self._playwright = None
+            self._browser = None
+            self._semaphore = asyncio.Semaphore(self.max_contexts)
+            self._launch_lock = asyncio.Lock()
+            self._uses = 0
+
+    @staticmethod
+    def _release(loop, browser, playwright):
+        """Close the browser and Playwright driver started on a previous event loop."""
+        if playwright is None:
+            return
+        if loop is not None and loop.is_running():
+            async def close():
+                try:
+                    if browser is not None:
+                        await browser.close()
+                    await playwright.stop()
+                except Exception as e:
+                    logging.info(f"Browser pool: error closing previous browser {e}")
+            asyncio.run_coroutine_threadsafe(close(), loop)
+            return
+        # Its loop is gone, so the driver cannot be asked to stop: kill it, Chromium exits when its pipe closes
+        for pid in playwright_driver_pids():
+            logging.info(f"Browser pool: killing Playwright driver {pid} left by a previous event loop")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def rss_mb(self):
+        return sum(process_tree_rss_mb(pid) for pid in playwright_driver_pids())
+
+    def _on_disconnected(self, browser):
+        if browser is self._browser:
+            logging.info("Browser pool: browser disconnected")
+            self.crashes += 1
+            self._browser = None
+
+    async def _ensure_browser(self):
+        async with self._launch_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return self._browser
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            with metrics.time("browser_launch"):
+                self._browser = await self._playwright.chromium.launch(headless=True)
+            self._browser.on("disconnected", self._on_disconnected)
+            self._uses = 0
+            self.launches += 1
+            metrics.inc("browser_launches_total")
+            logging.info(f"Browser pool: Chromium launched (#{self.launches})")
+            return self._browser
+
+    async def _close_browser(self):
+        browser, self._browser = self._browser, None
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception as e:
+                logging.info(f"Browser pool: error closing browser {e}")
+
+    async def _maybe_recycle(self):
+        if self._browser is None:
+            return
+        if self._uses >= self.max_uses or self.rss_mb() > self.max_rss_mb:
+            self._recycle_pending = True
+        if self._recycle_pending and self.in_use == 0:
+            logging.info(f"Browser pool: recycling browser after {self._uses} uses")
+            self._recycle_pending = False
+            self.recycles += 1
+            await self._close_browser()
+
+    @asynccontextmanager
+    async def context(self, **context_options):
+        self._bind_loop()
+        start = time.perf_counter()
+        async with self._semaphore:
+            self.acquire_wait_total += time.perf_counter() - start
+            self.acquired += 1
+            context = None
+            for attempt in range(2):
+                browser = await self._ensure_browser()
+                try:
+                    context = await browser.new_context(**context_options)
+                    break
+                except Exception:
+                    # Browser died between the check and the call: relaunch once
+                    if attempt:
+                        raise
+                    self.crashes += 1
+                    await self._close_browser()
+            self._uses += 1
+            self.in_use += 1
+            try:
+                yield context
+            finally:
+                self.in_use -= 1
+                try:
+                    await context.close()
+                except Exception:
+                    pass
+                await self._maybe_recycle()
+
+    def stats(self):
+        return {
+            "connected": bool(self._browser is not None and self._browser.is_connected()),
+            "launches": self.launches,
+            "crashes": self.crashes,
+            "recycles": self.recycles,
+            "uses_current_browser": self._uses,
+            "contexts_in_use": self.in_use,
+            "max_contexts": self.max_contexts,
+            "acquired": self.acquired,
+            "avg_acquire_wait_ms": round(1000 * self.acquire_wait_total / self.acquired, 2) if self.acquired else 0.0,
+            "rss_mb": round(self.rss_mb(), 1),
+        }
+
+
+browser_pool = BrowserPool()
+
+##################################################################
+# ASYNC ENGINE: ONE NATIVE THREAD OWNING THE ASYNCIO LOOP (AND PLAYWRIGHT)
+ASYNC_MAX_PENDING = int(os.getenv("ASYNC_MAX_PENDING", "8"))
+ASYNC_JOB_TIMEOUT = float(os.getenv("ASYNC_JOB_TIMEOUT", "180"))  # seconds
+ASYNC_EXECUTOR_WORKERS = int(os.getenv("ASYNC_EXECUTOR_WORKERS", "8"))
+
+
+class AsyncEngineBusy(RuntimeError):
+    pass
+
+
+def gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+def native_thread_api(name):
+    """_thread.<name> as it was before any gevent monkey-patching (real OS threads and locks)."""
+    if gevent_patched():
+        from gevent import monkey
+        return monkey.get_original("_thread", name)
+    return getattr(_thread, name)
+
+
+class NativeThreadExecutor(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor whose workers are OS threads under gevent, used as the engine loop's default executor there:
+    - the patched one would run calls as greenlets of a hub that never runs in the engine thread
+    - `workers` threads are started on first use and block on an unpatched SimpleQueue
+    - blocking calls made by a worker (requests, sqlite) go through that worker thread's own hub
+    """
+    def __init__(self, workers=ASYNC_EXECUTOR_WORKERS):
+        super().__init__(max_workers=workers)  # Only submit() is replaced; asyncio requires a ThreadPoolExecutor
+        self.workers = workers
+        self._calls_lock = native_thread_api("allocate_lock")()
+        self._calls = None
+
+    def _work(self):
+        while True:
+            future, fn, args, kwargs = self._calls.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._calls_lock:
+            if self._calls is None:
+                from gevent import monkey
+                self._calls = monkey.get_original("queue", "SimpleQueue")()
+                for _ in range(self.workers):
+                    native_thread_api("start_new_thread")(self._work, ())
+        future = Future()
+        self._calls.put((future, fn, args, kwargs))
+        return future
+
+
+def native_event_loop():
+    """
+    New asyncio loop for the engine thread. Under gevent the patched selectors, subprocess and threads would all
+    route through a hub that never runs in that thread (Playwright's driver launch dies with "child watchers are
+    only available on the default loop", then LoopExit), so the loop is built from the originals:
+    - an unpatched epoll selector and a NativeThreadExecutor as default executor
+    - subprocesses started with the original Popen and reaped through a pidfd instead of a watcher thread
+    """
+    if not gevent_patched():
+        return asyncio.new_event_loop()
+    from gevent import monkey
+    import importlib.util
+    spec = importlib.util.find_spec("subprocess")
+    subprocess = importlib.util.module_from_spec(spec)  # Fresh copy: gevent rewrote the shared module's globals
+    spec.loader.exec_module(subprocess)
+    asyncio.unix_events.subprocess = subprocess  # Only asyncio sees the unpatched Popen
+    loop = asyncio.SelectorEventLoop(monkey.get_original("selectors", "DefaultSelector")())
+    loop.set_default_executor(NativeThreadExecutor())
+    if sys.version_info < (3, 12):  # Newer versions pick the pidfd watcher themselves
+        watcher = asyncio.PidfdChildWatcher()
+        watcher.attach_loop(loop)
+        asyncio.set_child_watcher(watcher)
+    return loop
+
+
+class AsyncEngine:
+    """
+    Runs coroutines on one asyncio loop living in a dedicated OS thread, started on first use.
+    Request handlers and background threads submit coroutines and wait on the result:
+    - under gevent the wait happens in the hub's thread pool, so other greenlets keep being served
+    - at most `max_pending` coroutines are queued or running; beyond that AsyncEngineBusy is raised
+    - each coroutine is cancelled on the loop once its timeout expires
+    """
+    def __init__(self, max_pending=ASYNC_MAX_PENDING, timeout=ASYNC_JOB_TIMEOUT):
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._lock = native_thread_api("allocate_lock")()
+        self._loop = None
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = native_event_loop()
+                native_thread_api("start_new_thread")(self._run_loop, (self._loop,))
+            return self._loop
+
+    def _run_loop(self, loop):
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        except BaseException as e:
+            logging.info(f"Async engine loop died: {str(e)}")
+        finally:
+            with self._lock:
+                if self._loop is loop:
+                    self._loop = None  # The next run() starts a fresh loop instead of queueing onto a dead one
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+            if future.cancelled():
+                return
+            if future.exception() is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the engine loop and return its result (raises its exception or TimeoutError)."""
+        timeout = timeout or self.timeout
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                coro.close()
+                raise AsyncEngineBusy(f"{self.pending} coroutines already pending")
+            self.pending += 1
+            self.submitted += 1
+        future = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        future.add_done_callback(self._done)
+        try:
+            if gevent_patched():
+                import gevent
+                return gevent.get_hub().threadpool.apply(future.result, (timeout,))
+            return future.result(timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            future.cancel()  # Cancels the task on the loop as well
+            raise
+
+    def stats(self):
+        return {
+            "running": self._loop is not None and self._loop.is_running(),
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+        }
+
+
+async_engine = AsyncEngine()
+
+
+def run_async(coro, timeout=None):
+    return async_engine.run(coro, timeout)
+
+##################################################################
+# METRICS REGISTRY (PROMETHEUS TEXT FORMAT)
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class MetricsRegistry:
+    """
+    Process-local counters, histograms and gauges rendered at /metrics.
+    - observe() / inc() only take a native lock and bump a few numbers, so they are cheap on hot paths
+    - gauges are callbacks evaluated when /metrics is scraped
+    Each gunicorn worker exposes its own series.
+    """
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self._lock = native_thread_api("allocate_lock")()
+        self._meta = {}
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def describe(self, name, metric_type, help_text):
+        self._meta[name] = (metric_type, help_text)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_duration_seconds", time.perf_counter() - start, stage=stage)
+
+    def gauge(self, name, help_text, callback):
+        self.describe(name, "gauge", help_text)
+        self._gauges[name] = callback
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        lines = []
+
+        def header(name, default_type):
+            metric_type, help_text = self._meta.get(name, (default_type, name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, [list(v[0]), v[1], v[2]]) for k, v in self._histograms.items())
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                header(name, "counter")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in seen:
+                seen.add(name)
+                header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(list(self.buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {round(total, 6)}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
+        for name, callback in self._gauges.items():
+            try:
+                value = callback()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            header(name, "gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+metrics.describe("stage_duration_seconds", "histogram",
+                 "Duration of pipeline stages (browser launch, page.goto, parsing, image crop, mammoth, B2, LLM)")
+metrics.describe("http_request_duration_seconds", "histogram", "Flask request latency per route")
+metrics.describe("llm_tokens_total", "counter", "Tokens billed by the LLM per step and kind")
+metrics.describe("llm_requests_total", "counter", "LLM steps by cache status")
+metrics.describe("b2_uploads_total", "counter", "B2 uploads performed")
+metrics.describe("b2_uploads_skipped_total", "counter", "B2 uploads skipped because the content was unchanged")
+metrics.describe("b2_bytes_saved_total", "counter", "Bytes not uploaded to B2 thanks to dedupe")
+metrics.describe("browser_launches_total", "counter", "Chromium launches")
+for name in ("b2_uploads_total", "b2_uploads_skipped_total", "b2_bytes_saved_total", "browser_launches_total"):
+    metrics.inc(name, 0)  # Exported from the start, so rate() sees the first event
+
+
+@app.before_request
+def metrics_start_request():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def metrics_end_request(response):
+    start = getattr(g, "request_start", None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.observe("http_request_duration_seconds", time.perf_counter() - start,
+                        route=route, method=request.method, status=response.status_code)
+    return response
 
 ##################################################################
 # UTILITY: RE-ENCODING LATIN / UTF-8
@@ -99,13 +877,130 @@ def french_date(dt_string):
     # Format to full French date
     return date_obj.strftime("%A %d %B %Y").capitalize()
 
+##################################################################
+# UPLOAD LOG (BUFFERED APPENDER, ROTATION, TAIL READS)
+UPLOAD_LOG_FLUSH_SECONDS = float(os.getenv("UPLOAD_LOG_FLUSH_SECONDS", "1"))
+UPLOAD_LOG_READ_BLOCK = 64 * 1024
+
+
+class UploadLog:
+    """
+    Append-only upload_log.txt shared by all threads.
+    - lines are buffered and written through one kept-open handle at most every `flush_seconds`, before any
+      read and at exit; the handle is reopened when another worker rotated the file away
+    - a background OS thread flushes every `flush_seconds`, so lines written just before a quiet period still
+      reach the file (and other workers) without waiting for the next append
+    - rotated into upload_log.txt.N.gz once it passes LOG_MAX_BYTES
+    - read from the end (tail) or from a byte offset (since) without loading the whole history
+    """
+    def __init__(self, path=UPLOAD_LOG_FILE, flush_seconds=UPLOAD_LOG_FLUSH_SECONDS):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._file = None
+        self._pending = []
+        self._flushed_at = 0.0
+        self._flusher = None
+        atexit.register(self.flush)
+
+    def append(self, line):
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = native_thread_api("start_new_thread")(self._flush_periodically, ())
+            self._pending.append(line)
+            if time.time() - self._flushed_at >= self.flush_seconds:
+                self._flush_and_rotate()
+
+    def _rotated_away(self):
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _flush_and_rotate(self):
+        # Caller holds self._lock
+        if not self._pending:
+            return
+        with open(self.path + ".lock", "a") as lock_file:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)  # No line lands in a file another worker is compressing
+            if self._file is not None and self._rotated_away():
+                self._file.close()
+                self._file = None
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write("".join(self._pending))
+            self._file.flush()
+        self._pending.clear()
+        self._flushed_at = time.time()
+        if self._file.tell() >= LOG_MAX_BYTES:
+            self._file.close()
+            try:
+                rotate_log_file(self.path)
+            finally:
+                self._file = open(self.path, "a", encoding="utf-8")
+
+    def flush(self):
+        with self._lock:
+            self._flush_and_rotate()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.info(f"Upload log flush error {str(e)}")
+
+    def tail(self, n, status=None):
+        """Last n lines (optionally only those with the given status), reading blocks backwards from the end."""
+        self.flush()
+        marker = f"] {status.upper()}:" if status else None
+        lines, remainder = [], b""
+        with open(self.path, "rb") as f:
+            position = f.seek(0, os.SEEK_END)
+            while position > 0 and len(lines) < n:
+                size = min(UPLOAD_LOG_READ_BLOCK, position)
+                position -= size
+                f.seek(position)
+                block = f.read(size) + remainder
+                parts = block.split(b"\n")
+                # The first part may be cut in the middle of a line: keep it for the next block
+                remainder = parts.pop(0) if position > 0 else b""
+                for part in reversed(parts):
+                    line = part.decode("utf-8", errors="replace")
+                    if line and (marker is None or marker in line):
+                        lines.append(line)
+            if remainder and len(lines) < n:
+                line = remainder.decode("utf-8", errors="replace")
+                if marker is None or marker in line:
+                    lines.append(line)
+        return list(reversed(lines[:n]))
+
+    def since(self, offset, status=None):
+        """(lines appended after byte offset, new offset). An offset past the end means the log was rotated."""
+        self.flush()
+        marker = f"] {status.upper()}:" if status else None
+        with open(self.path, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            if offset > end:
+                offset = 0
+            f.seek(offset)
+            data = f.read(end - offset)
+        # Only hand out complete lines so the next poll starts on a line boundary
+        complete = data[:data.rfind(b"\n") + 1]
+        lines = [line for line in complete.decode("utf-8", errors="replace").splitlines()
+                 if line and (marker is None or marker in line)]
+        return lines, offset + len(complete)
+
+
+upload_log = UploadLog()
+
 ##################################################################
 # FUNCTION TO UPDATE LOG OF FILES BEING UPLOADED
 def log_upload(status, filename, detail=""):
     timestamp = datetime.utcnow().isoformat()
     log_line = f"[{timestamp}] {status.upper()}: {filename} {detail}".strip() + "\n"
-    with open(UPLOAD_LOG_FILE, "a", encoding="utf-8") as log:
-        log.write(log_line)
+    upload_log.append(log_line)
 
 ##################################################################
 # UTILITY : HTML-FORMATTED TIME STAMP
@@ -121,6 +1016,709 @@ def get_time_stamp_HTML():
     timestamp = now.strftime("%d-%b-%Y %H:%M:%S")
     return f'<br><small>Mis à jour le {timestamp}</small>'
 
+##################################################################
+# FILE MANIFEST (INDEX OF THE WORKING DIRECTORY)
+FILE_INDEX_RECONCILE = int(os.getenv("FILE_INDEX_RECONCILE", str(15 * 60)))  # seconds between full scans
+
+
+class FileIndex:
+    """
+    In-memory listing {relative path: (size, mtime)} of the working directory.
+    Files written by the app are recorded with touch(); a full os.walk reconciliation runs on
+    first use and then in the background whenever the last one is older than `reconcile_every`,
+    catching files written or removed behind our back (logs, manifests, manual changes).
+    touch() / discard() calls made while a walk is running are replayed over its result, so a file published
+    mid-scan is not dropped from the listing until the next reconciliation.
+    """
+    def __init__(self, base_path=".", reconcile_every=FILE_INDEX_RECONCILE):
+        self.base_path = base_path
+        self.reconcile_every = reconcile_every
+        self._lock = threading.Lock()
+        self._files = {}
+        self._scanned_at = None
+        self._scanning = False
+        self._walks = 0  # walks in progress
+        self._changes = {}  # key -> (time.monotonic(), (size, mtime) or None), recorded while a walk runs
+        self._walked_from = 0.0  # start of the walk self._files comes from
+        self.scans = 0
+
+    def _key(self, path):
+        return os.path.relpath(path, start=self.base_path)
+
+    def touch(self, *paths):
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                self.discard(path)
+                continue
+            self._record(self._key(path), (st.st_size, st.st_mtime))
+
+    def discard(self, path):
+        self._record(self._key(path), None)
+
+    def _record(self, key, entry):
+        with self._lock:
+            if entry is None:
+                self._files.pop(key, None)
+            else:
+                self._files[key] = entry
+            if self._walks:
+                self._changes[key] = (time.monotonic(), entry)
+
+    def reconcile(self):
+        with self._lock:
+            self._walks += 1
+        started = time.monotonic()
+        files = {}
+        for root, _, names in os.walk(self.base_path):
+            for name in names:
+                full_path = os.path.join(root, name)
+                try:
+                    st = os.stat(full_path)
+                except OSError:
+                    continue
+                files[self._key(full_path)] = (st.st_size, st.st_mtime)
+        with self._lock:
+            self._walks -= 1
+            if started >= self._walked_from:  # Otherwise a walk that started later already replaced the listing
+                for key, (changed_at, entry) in self._changes.items():
+                    if changed_at < started:
+                        continue
+                    if entry is None:
+                        files.pop(key, None)
+                    else:
+                        files[key] = entry
+                self._files = files
+                self._walked_from = started
+            if not self._walks:
+                self._changes = {}
+            self._scanned_at = time.time()
+            self._scanning = False
+            self.scans += 1
+
+    def _background_reconcile(self):
+        try:
+            self.reconcile()
+        except Exception as e:
+            self._scanning = False
+            logging.info(f"/show_dir reconciliation failed {str(e)}")
+
+    def listing(self, prefix="", sort="name", reverse=False):
+        """Return [(path, size, mtime)] under `prefix`, sorted by 'name', 'size' or 'mtime'."""
+        if self._scanned_at is None:
+            self.reconcile()
+        elif time.time() - self._scanned_at > self.reconcile_every and not self._scanning:
+            self._scanning = True
+            threading.Thread(target=self._background_reconcile, daemon=True).start()
+        with self._lock:
+            entries = [(path, size, mtime) for path, (size, mtime) in self._files.items() if path.startswith(prefix)]
+        sort_field = {"name": 0, "size": 1, "mtime": 2}[sort]
+        entries.sort(key=lambda e: (e[sort_field], e[0]), reverse=reverse)
+        return entries
+
+
+file_index = FileIndex()
+
+##################################################################
+# PUBLISHED ARTIFACTS (STRONG ETAGS, PRECOMPRESSED VARIANTS)
+ARTIFACT_BROTLI_QUALITY = int(os.getenv("ARTIFACT_BROTLI_QUALITY", "9"))
+artifact_lock = threading.Lock()
+
+
+def publish_artifact(path):
+    """
+    Compute the ETag of a freshly written artifact and write its path.gz / path.br variants next to it.
+    The ETag and the source mtime are kept in path.etag so every worker serves the same validators.
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    etag = hashlib.sha256(content).hexdigest()[:32]
+    with artifact_lock:
+        with open(path + ".gz.tmp", "wb") as f:
+            f.write(gzip.compress(content, compresslevel=9, mtime=0))
+        os.replace(path + ".gz.tmp", path + ".gz")
+        if brotli is not None:
+            with open(path + ".br.tmp", "wb") as f:
+                f.write(brotli.compress(content, quality=ARTIFACT_BROTLI_QUALITY))
+            os.replace(path + ".br.tmp", path + ".br")
+        write_json_atomic(path + ".etag", {"etag": etag, "mtime_ns": os.stat(path).st_mtime_ns}, indent=None)
+    file_index.touch(path + ".gz", path + ".br", path + ".etag")
+    return etag
+
+
+def artifact_etag(path):
+    """ETag of an artifact, publishing it again if it was written without publish_artifact()."""
+    try:
+        with open(path + ".etag", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["mtime_ns"] == os.stat(path).st_mtime_ns:
+            return meta["etag"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return publish_artifact(path)
+
+
+def serve_artifact(path, mimetype):
+    """send_file() with If-None-Match -> 304 and the precompressed variant chosen from Accept-Encoding."""
+    etag = artifact_etag(path)
+    encodings = [("br", ".br"), ("gzip", ".gz")] if brotli is not None else [("gzip", ".gz")]
+    for encoding, suffix in encodings:
+        if encoding in request.accept_encodings and os.path.exists(path + suffix):
+            # Each representation needs its own strong validator
+            served_path, served_etag, content_encoding = path + suffix, f"{etag}-{encoding}", encoding
+            break
+    else:
+        served_path, served_etag, content_encoding = path, etag, None
+
+    if request.if_none_match.contains(served_etag):
+        response = Response(status=304)
+    else:
+        response = send_file(served_path, mimetype=mimetype, conditional=False, etag=False)
+        if content_encoding is not None:
+            response.headers["Content-Encoding"] = content_encoding
+    response.set_etag(served_etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+##################################################################
+# MASS SCHEDULE PARISHES (REGISTRY)
+SCHEDULE_JSON_PATH = "static/schedule.json"
+SCHEDULE_MERGED_PATH = "static/schedule_all.json"
+SCHEDULE_MERGED_B2_NAME = "horaires_messes_secteur.json"
+SCHEDULE_DEFAULT_PARISH = "bois-renou"
+SCHEDULE_URL = "https://messes.info/horaires/paroisse%20notre%20dame%20du%20Bois%20Renou?display=TABLE"
+# Display names used in the cleaned schedule (messes.info name -> name shown on the website)
+SCHEDULE_CHURCHES = {
+    'Église Notre Dame de la Visitation': 'Hirel',
+    "Église Notre-Dame de l'Assomption": 'La Gouesnière',
+    'Église Saint-Benoit': 'Saint Benoît',
+    'Église Saint-Louis': 'Vildé La Marine',
+    'Église Saint-Méen-et-Sainte-Croix': 'La Fresnais',
+    'Église Saint-Méloir': 'Saint Méloir'
+}
+# JSON {key: {"name", "url", "churches", "b2_name"}} adding neighbouring parishes (or overriding the home one)
+SCHEDULE_PARISHES_FILE = os.getenv("SCHEDULE_PARISHES_FILE")
+SCHEDULE_RESERVED_KEYS = {"all", "changes"}  # taken by /schedule/all and /schedule/changes
+
+
+def load_schedule_parishes(path=SCHEDULE_PARISHES_FILE):
+    """
+    Parishes whose schedule is scraped: {key: {"name", "url", "churches", "b2_name", "path"}}.
+    - churches: messes.info church name -> name shown on the website (unknown churches keep their name)
+    - b2_name: remote name of the parish's cleaned JSON; path: its local copy
+    """
+    parishes = {
+        SCHEDULE_DEFAULT_PARISH: {"name": "Paroisse Notre Dame du Bois Renou", "url": SCHEDULE_URL,
+                                  "churches": SCHEDULE_CHURCHES, "b2_name": "horaires_messes.json"},
+    }
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            for key, parish in json.load(f).items():
+                parishes.setdefault(key, {}).update(parish)
+    for key, parish in parishes.items():
+        if key in SCHEDULE_RESERVED_KEYS or not re.fullmatch(r"[a-z0-9_-]+", key) or "url" not in parish:
+            raise ValueError(f"Invalid parish '{key}' in {path}")
+        parish.setdefault("name", key)
+        parish.setdefault("churches", {})
+        parish.setdefault("b2_name", f"horaires_messes_{key}.json")
+        parish["path"] = SCHEDULE_JSON_PATH if key == SCHEDULE_DEFAULT_PARISH else f"static/schedule_{key}.json"
+    return parishes
+
+
+SCHEDULE_PARISHES = load_schedule_parishes()
+
+##################################################################
+# MASS SCHEDULE STORE (SQLITE, INDEXED BY DATE AND PLACE)
+SCHEDULE_DB_PATH = "schedule.sqlite3"
+SCHEDULE_CHANGES_KEEP_DAYS = int(os.getenv("SCHEDULE_CHANGES_KEEP_DAYS", "90"))  # history of /schedule/changes
+# Month names and abbreviations as printed by messes.info, by their first 4 (or 3) letters
+SCHEDULE_MONTHS = {
+    'janv': 1, 'févr': 2, 'fevr': 2, 'mars': 3, 'avr': 4, 'mai': 5, 'juin': 6,
+    'juil': 7, 'août': 8, 'aout': 8, 'sept': 9, 'oct': 10, 'nov': 11, 'déc': 12, 'dec': 12
+}
+SCHEDULE_DATE_PATTERN = re.compile(r"(\d{1,2})(?:er)?\s+([^\W\d_]+)\.?(?:\s+(\d{4}))?")
+SCHEDULE_HOUR_PATTERN = re.compile(r"(\d{1,2})\s*[hH:]\s*(\d{2})?")
+
+
+def schedule_row_date(row, today=None):
+    """Calendar date of a cleaned row ('12 octobre 2025', '1er nov.'), or None if it cannot be read."""
+    match = SCHEDULE_DATE_PATTERN.search(row['Date'])
+    if match is None:
+        return None
+    word = match.group(2).lower()
+    month = SCHEDULE_MONTHS.get(word[:4]) or SCHEDULE_MONTHS.get(word[:3])
+    if month is None:
+        return None
+    today = today or date.today()
+    try:
+        if match.group(3):
+            return date(int(match.group(3)), month, int(match.group(1)))
+        # No year printed: the schedule only looks a few months ahead (and a little behind)
+        day = date(today.year, month, int(match.group(1)))
+        return day.replace(year=today.year + 1) if day < today - timedelta(days=183) else day
+    except ValueError:
+        return None
+
+
+def schedule_row_sort_key(row):
+    day = schedule_row_date(row)
+    match = SCHEDULE_HOUR_PATTERN.search(row['Heure'])
+    return (day or date.max, (int(match.group(1)), int(match.group(2) or 0)) if match else (24, 0))
+
+
+class ScheduleStore:
+    """
+    Cleaned rows of every parish in SQLite (WAL, shared by the gunicorn workers), upserted after each scrape.
+    - one row per (parish, day, heure, ou, celebration), so two masses at the same church and time stay apart:
+      day is the ISO date ('' if unreadable), minute the time of day
+    - indexed on (day, minute) and (ou, day), so date-range and church queries only read matching rows
+    - masses no longer listed by a scrape are deleted from the first date it covers onwards; older rows stay
+    - every scrape that adds, removes or modifies masses gets a new version (global, increasing) recording each
+      changed row; versions are kept SCHEDULE_CHANGES_KEEP_DAYS days and flagged once published to B2
+    """
+    MASSES_TABLE = """
+        CREATE TABLE IF NOT EXISTS masses (
+            parish TEXT NOT NULL,
+            day TEXT NOT NULL,
+            minute INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            jour TEXT NOT NULL,
+            heure TEXT NOT NULL,
+            ou TEXT NOT NULL COLLATE NOCASE,
+            celebration TEXT NOT NULL,
+            seen_at REAL NOT NULL,
+            PRIMARY KEY (parish, day, heure, ou, celebration)
+        )
+    """
+    SCHEMA = MASSES_TABLE + """;
+        CREATE INDEX IF NOT EXISTS masses_day ON masses (day, minute);
+        CREATE INDEX IF NOT EXISTS masses_ou_day ON masses (ou, day);
+        CREATE TABLE IF NOT EXISTS versions (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            parish TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            added INTEGER NOT NULL,
+            removed INTEGER NOT NULL,
+            modified INTEGER NOT NULL,
+            published INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            version INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            row TEXT NOT NULL,
+            previous TEXT
+        );
+        CREATE INDEX IF NOT EXISTS changes_version ON changes (version);
+    """
+    ROW_COLUMNS = "day, heure, ou, date, jour, celebration"
+
+    def __init__(self, path=SCHEDULE_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit: writes take BEGIN IMMEDIATE so concurrent workers diff against each other's results
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._migrate()
+        self._db.executescript(self.SCHEMA)
+        self.upserts = 0
+        self.queries = 0
+
+    def _primary_key(self):
+        columns = [column for column in self._db.execute("PRAGMA table_info(masses)") if column[5]]
+        return [column[1] for column in sorted(columns, key=lambda column: column[5])]
+
+    def _migrate(self):
+        # Stores created before celebration joined the primary key: rebuild the masses table, keeping its rows
+        if not self._primary_key() or "celebration" in self._primary_key():
+            return
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if "celebration" not in self._primary_key():  # Another worker may have migrated meanwhile
+                self._db.execute("ALTER TABLE masses RENAME TO masses_old")
+                self._db.execute("DROP INDEX IF EXISTS masses_day")
+                self._db.execute("DROP INDEX IF EXISTS masses_ou_day")
+                self._db.execute(self.MASSES_TABLE)
+                self._db.execute("INSERT OR IGNORE INTO masses SELECT * FROM masses_old")
+                self._db.execute("DROP TABLE masses_old")
+                logging.info("Schedule store: celebration added to the primary key of masses")
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _record(parish, row, seen_at):
+        day = schedule_row_date(row)
+        match = SCHEDULE_HOUR_PATTERN.search(row['Heure'])
+        minute = 60 * int(match.group(1)) + int(match.group(2) or 0) if match else 24 * 60
+        return (parish, day.isoformat() if day else "", minute, row['Date'], row['Jour'], row['Heure'],
+                row['Où'], row['Célébration'], seen_at)
+
+    @staticmethod
+    def _row(day, heure, ou, date_label, jour, celebration):
+        return {'Date': date_label, 'Jour': jour, 'Heure': heure, 'Où': ou, 'Célébration': celebration}
+
+    def _diff(self, parish, records, first_day):
+        """[(kind, row, previous row or None)] between the stored rows from first_day on and a new scrape."""
+        stored = {(r[0], r[1], r[2], r[5]): r for r in self._db.execute(
+            f"SELECT {self.ROW_COLUMNS} FROM masses WHERE parish = ? AND (day >= ? OR day = '')",
+            (parish, first_day))}
+        scraped = {(r[1], r[5], r[6], r[7]): (r[1], r[5], r[6], r[3], r[4], r[7]) for r in records}
+        changes = []
+        for key, new in scraped.items():
+            old = stored.get(key)
+            if old is None:
+                changes.append(("added", self._row(*new), None))
+            elif old != new:
+                changes.append(("modified", self._row(*new), self._row(*old)))
+        changes.extend(("removed", self._row(*old), None) for key, old in stored.items() if key not in scraped)
+        return changes
+
+    def replace(self, parish, rows):
+        """
+        Upsert the rows of one scrape of `parish` and drop its masses the scrape no longer lists.
+        Returns {"version": new version or None if nothing changed, "added", "removed", "modified"}.
+        """
+        seen_at = time.time()
+        records = [self._record(parish, row, seen_at) for row in rows]
+        first_day = min((record[1] for record in records if record[1]), default="")
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                changes = self._diff(parish, records, first_day)
+                self._db.executemany(
+                    "INSERT INTO masses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (parish, day, heure, ou, celebration) DO UPDATE SET minute = excluded.minute, "
+                    "date = excluded.date, jour = excluded.jour, seen_at = excluded.seen_at", records)
+                self._db.execute("DELETE FROM masses WHERE parish = ? AND (day >= ? OR day = '') AND seen_at < ?",
+                                 (parish, first_day, seen_at))
+                counts = {kind: sum(change[0] == kind for change in changes)
+                          for kind in ("added", "removed", "modified")}
+                version = None
+                if changes:
+                    version = self._db.execute(
+                        "INSERT INTO versions (parish, created_at, added, removed, modified) VALUES (?, ?, ?, ?, ?)",
+                        (parish, seen_at, counts["added"], counts["removed"], counts["modified"])).lastrowid
+                    self._db.executemany("INSERT INTO changes VALUES (?, ?, ?, ?)", [
+                        (version, kind, json.dumps(row, ensure_ascii=False),
+                         json.dumps(previous, ensure_ascii=False) if previous is not None else None)
+                        for kind, row, previous in changes])
+                    self._prune(seen_at - SCHEDULE_CHANGES_KEEP_DAYS * 24 * 60 * 60)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self.upserts += len(records)
+        if version is not None:
+            logging.info(f"Schedule store: {parish} version {version} {counts}")
+        return dict(counts, version=version)
+
+    def _prune(self, before):
+        # Keep the latest version whatever its age, so the current version number is never lost
+        self._db.execute("DELETE FROM changes WHERE version IN (SELECT version FROM versions WHERE created_at < ? "
+                         "AND version < (SELECT MAX(version) FROM versions))", (before,))
+        self._db.execute("DELETE FROM versions WHERE created_at < ? AND version < (SELECT MAX(version) FROM versions)",
+                         (before,))
+
+    def version(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(MAX(version), 0) FROM versions").fetchone()[0]
+
+    def changes(self, since, parish=None):
+        """
+        Changes after version `since`: {"version": current, "since", "complete": False when versions after `since`
+        were pruned (the client should reload the full schedule), "changes": [{"version", "parish", "change",
+        "row", "previous" (modified rows only)}]}.
+        """
+        with metrics.time("schedule_query"), self._lock:
+            current, oldest = self._db.execute(
+                "SELECT COALESCE(MAX(version), 0), COALESCE(MIN(version), 1) FROM versions").fetchone()
+            records = self._db.execute(
+                "SELECT v.version, v.parish, c.kind, c.row, c.previous FROM changes c "
+                "JOIN versions v ON v.version = c.version WHERE c.version > ?"
+                + (" AND v.parish = ?" if parish is not None else "") + " ORDER BY c.version, c.rowid",
+                (since, parish) if parish is not None else (since,)).fetchall()
+        changes = []
+        for version, key, kind, row, previous in records:
+            change = {"version": version, "parish": key, "change": kind, "row": json.loads(row)}
+            if previous is not None:
+                change["previous"] = json.loads(previous)
+            changes.append(change)
+        # since > current: the client saw a store that no longer exists (new disk), it has to reload too
+        return {"version": current, "since": since, "complete": oldest - 1 <= since <= current,
+                "changes": changes}
+
+    def unpublished(self):
+        """{parish: latest version} of the parishes with changes not yet published to B2."""
+        with self._lock:
+            return dict(self._db.execute(
+                "SELECT parish, MAX(version) FROM versions WHERE published = 0 GROUP BY parish").fetchall())
+
+    def mark_published(self, versions):
+        with self._lock:
+            self._db.executemany("UPDATE versions SET published = 1 WHERE parish = ? AND version <= ?",
+                                 list(versions.items()))
+
+    def count(self, parish):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM masses WHERE parish = ?", (parish,)).fetchone()[0]
+
+    def query(self, parish=None, start=None, end=None, ou=None, limit=None):
+        """
+        Rows in the cleaned format ('Paroisse' added when all parishes are queried), by date and time.
+        - start / end: ISO dates, inclusive; ou: church display name (case-insensitive); limit: max rows
+        """
+        clauses, params = [], []
+        for clause, value in (("parish = ?", parish), ("day >= ?", start), ("day <= ?", end), ("ou = ?", ou)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        if start is not None or end is not None:
+            clauses.append("day != ''")
+        sql = ("SELECT parish, date, jour, heure, ou, celebration FROM masses"
+               + (" WHERE " + " AND ".join(clauses) if clauses else "")
+               + " ORDER BY day = '', day, minute, parish" + (" LIMIT ?" if limit is not None else ""))
+        if limit is not None:
+            params.append(limit)
+        with metrics.time("schedule_query"), self._lock:
+            records = self._db.execute(sql, params).fetchall()
+        self.queries += 1
+        rows = []
+        for key, date_label, jour, heure, ou_name, celebration in records:
+            row = {'Date': date_label, 'Jour': jour, 'Heure': heure, 'Où': ou_name, 'Célébration': celebration}
+            if parish is None:
+                row['Paroisse'] = SCHEDULE_PARISHES[key]["name"] if key in SCHEDULE_PARISHES else key
+            rows.append(row)
+        return rows
+
+
+schedule_store = ScheduleStore()
+
+##################################################################
+# MASS SCHEDULE CACHE (MEMORY + DISK, STALE-WHILE-REVALIDATE)
+SCHEDULE_CACHE_TTL = int(os.getenv("SCHEDULE_CACHE_TTL", str(60 * 60)))  # seconds
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls into one: the first caller runs the function, the others wait for its
+    result (or exception) instead of running it again.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = None
+
+    @property
+    def busy(self):
+        return self._inflight is not None
+
+    def run(self, function, *args):
+        with self._lock:
+            flight = self._inflight
+            leader = flight is None
+            if leader:
+                flight = self._inflight = {"done": threading.Event(), "error": None, "result": None}
+        if not leader:
+            flight["done"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["result"]
+        try:
+            flight["result"] = function(*args)
+            return flight["result"]
+        except Exception as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight = None
+            flight["done"].set()
+
+
+class ScheduleCache:
+    """
+    Cleaned mass schedule of one parish kept in memory and mirrored to its JSON file (static/schedule.json
+    for the home parish).
+    - fresh entries are served as-is (HIT)
+    - stale entries are served immediately while one background scrape refreshes them (STALE)
+    - without any entry the caller waits for a scrape (MISS)
+    Concurrent scrapes collapse into a single in-flight fetch_and_clean_schedule() shared by all waiters.
+    """
+    def __init__(self, parish=SCHEDULE_DEFAULT_PARISH, ttl=SCHEDULE_CACHE_TTL):
+        self.parish = parish
+        self.path = SCHEDULE_PARISHES[parish]["path"]
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = None
+        self._fetched_at = None
+        self._flight = SingleFlight()
+        self.source = "disk"
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.scrapes = 0
+        self.last_changes = None
+        self._load_from_disk()
+        if self._data and not schedule_store.count(parish):
+            schedule_store.replace(parish, self._data)  # first start with the SQLite store
+
+    def _load_from_disk(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+            self._fetched_at = os.path.getmtime(self.path)
+        except (OSError, ValueError):
+            self._data, self._fetched_at = None, None
+
+    def _store(self, data):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        write_json_atomic(self.path, data, indent=2)
+        file_index.touch(self.path)
+        publish_artifact(self.path)
+        with self._lock:
+            self._data = data
+            self._fetched_at = time.time()
+
+    def _scrape(self, mode=None):
+        # Single flight: the first caller scrapes, the others wait for its result
+        return self._flight.run(self._fetch, mode)
+
+    def _fetch(self, mode):
+        self.scrapes += 1
+        report = {}
+        data = run_async(fetch_and_clean_schedule(mode, report, self.parish))
+        return self.accept(data, report.get("source"))
+
+    def _background_refresh(self):
+        try:
+            self._scrape()
+        except Exception as e:
+            logging.info(f"/schedule background refresh of {self.parish} failed {str(e)}")
+
+    def accept(self, data, source):
+        """Store freshly scraped rows and return what the cache now holds (changes found: self.last_changes)."""
+        self.last_changes = None
+        # An empty table is more likely a broken page than an empty calendar
+        if data or self._data is None:
+            self._store(data)
+            self.last_changes = schedule_store.replace(self.parish, data)
+            self.source = source
+        return self._data
+
+    @property
+    def data(self):
+        return self._data
+
+    def age(self):
+        return None if self._fetched_at is None else max(0, int(time.time() - self._fetched_at))
+
+    def get(self):
+        """Return (data, age in seconds, cache status)."""
+        if self._data is None:
+            self.misses += 1
+            data = self._scrape()
+            return data, self.age(), "MISS"
+        if self.age() < self.ttl:
+            self.hits += 1
+            return self._data, self.age(), "HIT"
+        self.stale += 1
+        if not self._flight.busy:
+            threading.Thread(target=self._background_refresh, daemon=True).start()
+        return self._data, self.age(), "STALE"
+
+    def refresh(self, mode=None):
+        return self._scrape(mode)
+
+    def stats(self):
+        served = self.hits + self.stale + self.misses
+        return {
+            "hits": self.hits,
+            "stale": self.stale,
+            "misses": self.misses,
+            "scrapes": self.scrapes,
+            "hit_rate": round((self.hits + self.stale) / served, 3) if served else 0.0,
+            "age": self.age(),
+            "ttl": self.ttl,
+            "source": self.source,
+        }
+
+
+class ScheduleFeeds:
+    """
+    One ScheduleCache per registered parish plus the merged feed of all parishes (static/schedule_all.json).
+    - refresh() scrapes every parish concurrently in a single run_async() call (one browser, N contexts);
+      concurrent refreshes collapse into one in-flight fan-out shared by all waiters
+    - a parish whose scrape fails keeps its previous rows, in its own feed and in the merged one
+    - merged rows carry the parish name under 'Paroisse' and are ordered by date and time
+    """
+    def __init__(self, parishes, merged_path=SCHEDULE_MERGED_PATH):
+        self.caches = {key: ScheduleCache(key) for key in parishes}
+        self.merged_path = merged_path
+        self._flight = SingleFlight()
+        self.refreshes = 0
+
+    def _fan_out(self, mode=None):
+        self.refreshes += 1
+        reports = {}
+        results = run_async(fetch_all_schedules(list(self.caches), mode, reports))
+        for key, result in results.items():
+            if isinstance(result, Exception):
+                reports[key]["error"] = str(result)
+                logging.info(f"/refresh scrape of {key} failed {str(result)}")
+                continue
+            self.caches[key].accept(result, reports[key].get("source"))
+            reports[key]["changes"] = self.caches[key].last_changes
+        if all(isinstance(result, Exception) for result in results.values()):
+            raise next(iter(results.values()))
+        self.write_merged()
+        return reports
+
+    def refresh(self, mode=None):
+        """Scrape all parishes and rewrite their feeds and the merged feed. Returns {key: fetch report}."""
+        return self._flight.run(self._fan_out, mode)
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logging.info(f"/schedule/all background refresh failed {str(e)}")
+
+    def merged(self):
+        rows = []
+        for key, cache in self.caches.items():
+            name = SCHEDULE_PARISHES[key]["name"]
+            rows.extend(dict(row, Paroisse=name) for row in cache.data or [])
+        rows.sort(key=schedule_row_sort_key)  # stable: masses at the same time keep the registry order
+        return rows
+
+    def write_merged(self):
+        os.makedirs(os.path.dirname(self.merged_path) or ".", exist_ok=True)
+        write_json_atomic(self.merged_path, self.merged(), indent=2)
+        file_index.touch(self.merged_path)
+        publish_artifact(self.merged_path)
+
+    def age(self):
+        # Parishes never scraped successfully are simply missing from the merged feed
+        ages = [cache.age() for cache in self.caches.values() if cache.age() is not None]
+        return max(ages) if ages else None
+
+    def get_merged(self):
+        """Make sure the merged feed exists; return (age in seconds of its oldest parish, cache status)."""
+        if self.age() is None or not os.path.exists(self.merged_path):
+            self.refresh()
+            return self.age(), "MISS"
+        if self.age() < SCHEDULE_CACHE_TTL:
+            return self.age(), "HIT"
+        if not self._flight.busy:
+            threading.Thread(target=self._background_refresh, daemon=True).start()
+        return self.age(), "STALE"
+
+
+schedule_feeds = ScheduleFeeds(SCHEDULE_PARISHES)
+schedule_cache = schedule_feeds.caches[SCHEDULE_DEFAULT_PARISH]
+
 ##################################################################
 # QUERY - BASE
 @app.route('/')
@@ -131,97 +1729,302 @@ def home():
 # QUERY - FETCH MASS SCHEDULE ON THE FLY
 @app.route('/schedule')
 def get_schedule():
-    return asyncio.get_event_loop().run_until_complete(fetch_and_clean_schedule())
+    return schedule_response(schedule_cache, SCHEDULE_DEFAULT_PARISH)
+
+
+@app.route('/schedule/<parish>')
+def get_parish_schedule(parish):
+    cache = schedule_feeds.caches.get(parish)
+    if cache is None:
+        return jsonify({"error": f"Unknown parish '{parish}'", "parishes": list(schedule_feeds.caches)}), 404
+    return schedule_response(cache, parish)
 
-##################################################################
-# QUERY - REFRESH MASS SCHEDULE AND STORE
-@app.route('/refresh')
-def refresh_schedule():
-    data = asyncio.get_event_loop().run_until_complete(fetch_and_clean_schedule())
 
-    os.makedirs("static", exist_ok=True)
+def schedule_query_filters():
+    """?from=&to= (YYYY-MM-DD), ?ou= (church) and ?limit= of a /schedule query, or None without any filter."""
+    if not any(name in request.args for name in ("from", "to", "ou", "limit")):
+        return None
+    filters = {"ou": request.args.get("ou") or None}
+    for name, key in (("from", "start"), ("to", "end")):
+        value = request.args.get(name)
+        filters[key] = date.fromisoformat(value).isoformat() if value else None
+    limit = request.args.get("limit")
+    filters["limit"] = int(limit) if limit else None
+    if filters["limit"] is not None and filters["limit"] < 1:
+        raise ValueError("limit must be a positive integer")
+    return filters
+
+
+def schedule_response(cache, parish=None):
+    try:
+        filters = schedule_query_filters()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {str(e)}"}), 400
+    data, age, status = cache.get()
+    if filters is not None:
+        # Served from the SQLite index rather than the whole JSON document
+        response = jsonify(schedule_store.query(parish, **filters))
+    elif os.path.exists(cache.path):
+        response = serve_artifact(cache.path, "application/json")
+    else:
+        response = jsonify(data)
+    response.headers["Age"] = str(age or 0)
+    response.headers["X-Cache"] = status
+    response.headers["X-Schedule-Source"] = cache.source or "none"
+    return response
 
-    # Save cleaned JSON
-    with open("static/schedule.json", "w", encoding="utf-8") as f:
-        json.dump(data.get_json(), f, ensure_ascii=False, indent=2)
+##################################################################
+# QUERY - SCHEDULE CHANGES SINCE A VERSION (DELTA FEED)
+@app.route('/schedule/changes')
+def get_schedule_changes():
+    # ?since=<version> (0: everything still recorded), optional ?parish=<key>
+    try:
+        since = int(request.args.get("since", "0"))
+    except ValueError:
+        return jsonify({"error": "since must be an integer version"}), 400
+    parish = request.args.get("parish")
+    if parish is not None and parish not in schedule_feeds.caches:
+        return jsonify({"error": f"Unknown parish '{parish}'", "parishes": list(schedule_feeds.caches)}), 404
+    delta = schedule_store.changes(since, parish)
+    response = jsonify(delta)
+    response.headers["X-Schedule-Version"] = str(delta["version"])
+    return response
 
-    # Upload JSON to BlackBlaze
-    push_b2_file("static/schedule.json","horaires_messes.json")
+##################################################################
+# QUERY - MERGED MASS SCHEDULE OF ALL PARISHES
+@app.route('/schedule/all')
+def get_merged_schedule():
+    try:
+        filters = schedule_query_filters()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {str(e)}"}), 400
+    age, status = schedule_feeds.get_merged()
+    if filters is not None:
+        response = jsonify(schedule_store.query(None, **filters))
+    else:
+        response = serve_artifact(schedule_feeds.merged_path, "application/json")
+    response.headers["Age"] = str(age or 0)
+    response.headers["X-Cache"] = status
+    return response
 
-    # Save last updated timestamp in French format
-    now = datetime.now()
-    formatted = now.strftime("%A %d %B %Y à %H:%M")
-    with open("static/last_updated.txt", "w", encoding="utf-8") as f:
-        f.write(formatted)
-    push_b2_file("static/last_updated.txt","horaires_messes_MAJ.txt")
+##################################################################
+# QUERY - REFRESH MASS SCHEDULE AND STORE
+@app.route('/refresh')
+def refresh_schedule():
+    mode = request.args.get("mode")
+    if mode and mode not in SCHEDULE_FETCH_MODES:
+        return f"Unknown mode '{mode}' (expected one of {', '.join(SCHEDULE_FETCH_MODES)})", 400
+    reports = refresh_and_publish_schedule(mode)
+
+    def summary(report):
+        changes = report.get("changes") or {}
+        if report.get("error"):
+            return report["error"]
+        if not changes.get("version"):
+            return f"{report.get('source')}, unchanged"
+        return (f"{report.get('source')}, version {changes['version']}: +{changes['added']} "
+                f"-{changes['removed']} ~{changes['modified']}")
+    parishes = ", ".join(f"{key}: {summary(report)}" for key, report in reports.items())
+    return (f"Schedule updated and saved to static/ for {len(reports)} parishes ({parishes}), "
+            f"version {schedule_store.version()}")
+
+
+def refresh_and_publish_schedule(mode=None):
+    # Scrape every parish concurrently (shared with any concurrent refresh) and save cleaned JSON
+    reports = schedule_feeds.refresh(mode)
 
     # Save heartbeat timestamp (ISO format)
+    now = datetime.now()
     with open("static/heartbeat.txt", "w") as hb:
         hb.write(now.isoformat())
-    push_b2_file("static/heartbeat.txt","heartbeat.txt")
+    file_index.touch("static/heartbeat.txt")
+    files = [("static/heartbeat.txt", "heartbeat.txt")]
+
+    # Publish only the parishes whose rows changed since their last publish (by any worker or /schedule miss)
+    pending = {key: version for key, version in schedule_store.unpublished().items() if key in schedule_feeds.caches}
+    if pending:
+        # Save last updated timestamp in French format
+        formatted = now.strftime("%A %d %B %Y à %H:%M")
+        with open("static/last_updated.txt", "w", encoding="utf-8") as f:
+            f.write(formatted)
+        file_index.touch("static/last_updated.txt")
+        files = [
+            (schedule_feeds.caches[key].path, SCHEDULE_PARISHES[key]["b2_name"]) for key in pending
+        ] + [
+            (SCHEDULE_MERGED_PATH, SCHEDULE_MERGED_B2_NAME),
+            ("static/last_updated.txt", "horaires_messes_MAJ.txt"),
+        ] + files
+    else:
+        logging.info("/refresh found no schedule change, only the heartbeat is published")
 
-    return "Schedule updated and saved to static/schedule.json"
+    # Upload JSON (changed parishes and merged), timestamp and heartbeat to BlackBlaze
+    uploads = push_b2_files(files)
+    if pending and all(upload["error"] is None for upload in uploads):
+        schedule_store.mark_published(pending)
+    return reports
 
 ##################################################################
 # FUNCTION TO FETCH MASS SCHEDULE AND PROCESS
-async def fetch_and_clean_schedule():
-    url = "https://messes.info/horaires/paroisse%20notre%20dame%20du%20Bois%20Renou?display=TABLE"
+SCHEDULE_FETCH_MODES = ("auto", "http", "browser")
+SCHEDULE_FETCH_MODE = os.getenv("SCHEDULE_FETCH_MODE", "auto")
+SCHEDULE_CONCURRENCY = int(os.getenv("SCHEDULE_CONCURRENCY", "4"))  # parishes scraped at the same time
+SCHEDULE_RATE_PER_SECOND = float(os.getenv("SCHEDULE_RATE_PER_SECOND", "2"))  # sustained page requests per second
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        page = await browser.new_page()
-        await page.goto(url, timeout=60000)
-        await page.wait_for_selector("tr td:nth-child(7)", timeout=15000)
-        content = await page.content()
-        await browser.close()
 
-    soup = BeautifulSoup(content, "html.parser")
-    rows = soup.find_all("tr")
+class RateLimiter:
+    """
+    Token bucket shared across threads and event loops: bursts of up to `burst` calls, then `rate` calls per second.
+    rate <= 0 disables the limit.
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self.delayed = 0
+
+    def reserve(self):
+        """Take a token; return how many seconds the caller has to wait for it (tokens may go negative)."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    async def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            self.delayed += 1
+            await asyncio.sleep(delay)
+
+
+schedule_rate_limiter = RateLimiter(SCHEDULE_RATE_PER_SECOND, burst=SCHEDULE_CONCURRENCY)
+
+
+async def fetch_schedule_page_http(url):
+    # Plain GET on the TABLE display: the 7-column rows are usually server-rendered
+    await schedule_rate_limiter.wait()
+    loop = asyncio.get_running_loop()
+    with metrics.time("http_fetch"):
+        response = await loop.run_in_executor(None, lambda: http_session.get(url, timeout=15))
+    response.raise_for_status()
+    return response.content
+
+
+async def fetch_schedule_page_browser(url):
+    async with browser_pool.context() as context:
+        page = await context.new_page()
+        await schedule_rate_limiter.wait()
+        with metrics.time("page_goto"):
+            await page.goto(url, timeout=60000)
+        with metrics.time("selector_wait"):
+            await page.wait_for_selector("tr td:nth-child(7)", timeout=15000)
+        return await page.content()
+
+
+SCHEDULE_DAYS = {
+    'lun': 'Lundi', 'mar': 'Mardi', 'mer': 'Mercredi',
+    'jeu': 'Jeudi', 'ven': 'Vendredi', 'sam': 'Samedi', 'dim': 'Dimanche'
+}
+# Rows of the TABLE display: CP, COMMUNE, LIEU DE CULTE, PAROISSE, DATE, HEURE, LITURGIE
+SCHEDULE_ROWS_XPATH = etree.XPath("//tr[count(td) = 7]")
+SCHEDULE_CELLS_XPATH = etree.XPath("td")
+
+
+def schedule_cell_text(cell):
+    # Same text as BeautifulSoup's get_text(strip=True): every text node stripped, joined without separator
+    return "".join(text.strip() for text in cell.itertext())
+
+
+def schedule_table_rows(content, churches=SCHEDULE_CHURCHES):
+    """Cleaned rows {'Date', 'Jour', 'Heure', 'Où', 'Célébration'} of the 7-column schedule table, in page order."""
+    with metrics.time("html_parse"):
+        root = etree.fromstring(content, etree.HTMLParser())
+        if root is None:
+            return []
+        rows = SCHEDULE_ROWS_XPATH(root)
 
-    mass_schedule = []
+    clean_schedule = []
     for row in rows:
-        cells = row.find_all("td")
-        if len(cells) == 7:
-            mass_schedule.append({
-                "CP": cells[0].get_text(strip=True),
-                "COMMUNE": cells[1].get_text(strip=True),
-                "LIEU DE CULTE": cells[2].get_text(strip=True),
-                "PAROISSE": cells[3].get_text(strip=True),
-                "DATE": cells[4].get_text(strip=True),
-                "HEURE": cells[5].get_text(strip=True),
-                "LITURGIE": cells[6].get_text(strip=True),
-            })
+        cells = SCHEDULE_CELLS_XPATH(row)
+        place, day, hour, liturgy = (schedule_cell_text(cells[i]) for i in (2, 4, 5, 6))
+        clean_schedule.append({
+            'Date': day[5:],  # Remove "dim. ", etc.
+            'Jour': SCHEDULE_DAYS.get(day[:3], day[:3]),
+            'Heure': hour,
+            'Où': churches.get(place, place),
+            'Célébration': liturgy
+        })
+    return clean_schedule
+
+
+async def fetch_and_clean_schedule(mode=None, report=None, parish=SCHEDULE_DEFAULT_PARISH):
+    """
+    Scrape and clean the mass schedule of one registered parish.
+    - mode: 'http' (no browser), 'browser' (Playwright) or 'auto' (http, then browser if no 7-column rows)
+    - report: optional dict filled with the path that served the call, its duration and row count
+    """
+    url = SCHEDULE_PARISHES[parish]["url"]
+    churches = SCHEDULE_PARISHES[parish]["churches"]
+    mode = mode or SCHEDULE_FETCH_MODE
+    if mode not in SCHEDULE_FETCH_MODES:
+        raise ValueError(f"Unknown schedule fetch mode '{mode}'")
+    start = time.perf_counter()
+
+    clean_schedule, source = [], None
+    if mode in ("auto", "http"):
+        try:
+            clean_schedule = schedule_table_rows(await fetch_schedule_page_http(url), churches)
+            source = "http"
+        except Exception as e:
+            if mode == "http":
+                raise
+            logging.info(f"/schedule {parish} http path failed {str(e)}")
+        if mode == "auto" and not clean_schedule:
+            logging.info(f"/schedule {parish} http path found no 7-column rows, falling back to browser")
+    if mode == "browser" or (mode == "auto" and not clean_schedule):
+        clean_schedule = schedule_table_rows(await fetch_schedule_page_browser(url), churches)
+        source = "browser"
+
+    elapsed_ms = round(1000 * (time.perf_counter() - start), 1)
+    logging.info(f"/schedule {parish} served by {source} path in {elapsed_ms} ms ({len(clean_schedule)} rows)")
+    if report is not None:
+        report.update({"source": source, "elapsed_ms": elapsed_ms, "rows": len(clean_schedule)})
+    return clean_schedule
+
+
+async def fetch_all_schedules(parishes=None, mode=None, reports=None):
+    """
+    Scrape several registered parishes concurrently on the current event loop.
+    - at most SCHEDULE_CONCURRENCY parishes at a time; page requests go through schedule_rate_limiter
+    - browser fetches are separate contexts of the shared Chromium (bounded by BROWSER_POOL_MAX_CONTEXTS)
+    - reports: optional dict filled with {parish: fetch report}
+    Returns {parish: cleaned rows, or the exception its scrape raised}.
+    """
+    parishes = list(parishes or SCHEDULE_PARISHES)
+    reports = {} if reports is None else reports
+    semaphore = asyncio.Semaphore(SCHEDULE_CONCURRENCY)
 
-    # Clean and format
-    mapping_churches = {
-        'Église Notre Dame de la Visitation': 'Hirel',
-        "Église Notre-Dame de l'Assomption": 'La Gouesnière',
-        'Église Saint-Benoit': 'Saint Benoît',
-        'Église Saint-Louis': 'Vildé La Marine',
-        'Église Saint-Méen-et-Sainte-Croix': 'La Fresnais',
-        'Église Saint-Méloir': 'Saint Méloir'
-    }
+    async def fetch(parish):
+        async with semaphore:
+            return await fetch_and_clean_schedule(mode, reports.setdefault(parish, {}), parish)
 
-    mapping_days = {
-        'lun': 'Lundi', 'mar': 'Mardi', 'mer': 'Mercredi',
-        'jeu': 'Jeudi', 'ven': 'Vendredi', 'sam': 'Samedi', 'dim': 'Dimanche'
-    }
+    start = time.perf_counter()
+    results = await asyncio.gather(*(fetch(parish) for parish in parishes), return_exceptions=True)
+    failed = sum(isinstance(result, Exception) for result in results)
+    logging.info(f"/refresh scraped {len(parishes) - failed}/{len(parishes)} parishes in "
+                 f"{round(1000 * (time.perf_counter() - start))} ms")
+    return dict(zip(parishes, results))
 
-    clean_schedule = []
-    for row in mass_schedule:
-        try:
-            clean_row = {
-                'Date': row['DATE'][5:],  # Remove "dim. ", etc.
-                'Jour': mapping_days.get(row['DATE'][:3], row['DATE'][:3]),
-                'Heure': row['HEURE'],
-                'Où': mapping_churches.get(row['LIEU DE CULTE'], row['LIEU DE CULTE']),
-                'Célébration': row['LITURGIE']
-            }
-            clean_schedule.append(clean_row)
-        except Exception:
-            continue
-
-    return jsonify(clean_schedule)
+##################################################################
+# QUERY - BROWSER POOL STATISTICS
+@app.route('/browser_pool')
+def show_browser_pool():
+    return jsonify({**browser_pool.stats(), "engine": async_engine.stats()})
 
 ##################################################################
 # QUERY - UPLOAD HTML FILE
@@ -230,6 +2033,8 @@ def upload_html():
     html_content = request.get_data(as_text=True)
     with open(HTML_FILE_PATH, "w", encoding="utf-8") as f:
         f.write(html_content)
+    file_index.touch(HTML_FILE_PATH)
+    publish_artifact(HTML_FILE_PATH)
     return "HTML saved", 200
 
 ##################################################################
@@ -237,7 +2042,7 @@ def upload_html():
 @app.route("/latest")
 def latest():
     if os.path.exists(HTML_FILE_PATH):
-        return send_file(HTML_FILE_PATH, mimetype="text/html")
+        return serve_artifact(HTML_FILE_PATH, "text/html")
     else:
         return "No HTML uploaded yet.", 404
 
@@ -255,6 +2060,7 @@ def upload_attachment():
     try:
         filepath = os.path.join(UPLOAD_FOLDER, filename)
         uploaded_file.save(filepath)
+        file_index.touch(filepath)
 
         log_upload("SUCCESS", filename)
         return f"✅ File '{filename}' saved", 200
@@ -267,13 +2073,25 @@ def upload_attachment():
 # QUERY - RETURN THE UPLOAD LOG
 @app.route("/upload_log")
 def show_log():
+    # ?tail=N (last N lines, default 1000) or ?since=<offset> (incremental polling), &status=SUCCESS|FAIL|QUEUED
+    upload_log.flush()
     if not os.path.exists(UPLOAD_LOG_FILE):
         return "No log available yet.", 404
 
-    with open(UPLOAD_LOG_FILE, "r", encoding="utf-8") as f:
-        log_content = f.read()
+    status = request.args.get("status")
+    try:
+        if "since" in request.args:
+            lines, offset = upload_log.since(max(0, int(request.args["since"])), status)
+        else:
+            lines = upload_log.tail(max(0, int(request.args.get("tail", 1000))), status)
+            offset = os.path.getsize(UPLOAD_LOG_FILE)
+    except ValueError:
+        return "tail and since must be integers", 400
 
-    return Response(f"<pre>{log_content}</pre>", mimetype="text/html")
+    log_content = "\n".join(lines)
+    response = Response(f"<pre>{log_content}</pre>", mimetype="text/html")
+    response.headers["X-Log-Offset"] = str(offset)
+    return response
 
 ##################################################################
 # QUERY - ERROR HANDLER
@@ -281,63 +2099,348 @@ def show_log():
 def request_entity_too_large(error):
     return "❌ File too large. Limit is 10MB.", 413
 
+##################################################################
+# ARCHIVE OF UPLOADED CONTENT (STREAMED, CACHED ON DISK)
+ARCHIVE_PATH = "content_archive.zip"
+ARCHIVE_INDEX_PATH = "content_archive.json"
+# Already compressed formats: deflating them again costs CPU for no size gain
+ARCHIVE_STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.pdf', '.zip', '.gz', '.docx', '.xlsx',
+                             '.pptx', '.mp3', '.mp4', '.m4a', '.mov'}
+
+
+class ArchiveSink:
+    """Write-only file object collecting zip output for a generator, optionally teeing it to a cache file."""
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        if self.cache_file is not None:
+            self.cache_file.write(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+class ContentArchive:
+    """
+    Zip of uploaded_files/ cached in content_archive.zip, its index in content_archive.json:
+    {"etag": SHA1 of the listing, "files": {arcname: [size, mtime_ns]}}
+    - unchanged listing: the cached archive is served as-is
+    - files only added since the last build: they are appended to a copy of the cached archive
+    - anything else: the archive is streamed file by file while the cache is rebuilt alongside
+    """
+    def __init__(self, folder=UPLOAD_FOLDER, path=ARCHIVE_PATH, index_path=ARCHIVE_INDEX_PATH):
+        self.folder = folder
+        self.path = path
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {"etag": None, "files": {}}
+
+    def scan(self):
+        """Return ({arcname: (path, size, mtime_ns)}, etag) for the current content of the folder."""
+        files = {}
+        for root, _, names in os.walk(self.folder):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files[os.path.relpath(path, start=self.folder)] = (path, st.st_size, st.st_mtime_ns)
+        listing = json.dumps(sorted((arc, size, mtime) for arc, (_, size, mtime) in files.items()))
+        return files, hashlib.sha1(listing.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _add(zf, path, arcname):
+        stored = Path(arcname).suffix.lower() in ARCHIVE_STORED_EXTENSIONS
+        zf.write(path, arcname=arcname, compress_type=zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+
+    def _save_index(self, etag, files):
+        self.index = {"etag": etag, "files": {arc: [size, mtime] for arc, (_, size, mtime) in files.items()}}
+        write_json_atomic(self.index_path, self.index)
+
+    def is_current(self, etag):
+        return self.index["etag"] == etag and os.path.exists(self.path)
+
+    def try_append(self, files, etag):
+        """Append new files to the cached archive when nothing else changed. Returns True on success."""
+        cached = self.index["files"]
+        if not cached or not os.path.exists(self.path):
+            return False
+        if any(arc not in files or list(files[arc][1:]) != entry for arc, entry in cached.items()):
+            return False
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            tmp_path = self.path + ".tmp"
+            shutil.copyfile(self.path, tmp_path)
+            with zipfile.ZipFile(tmp_path, "a") as zf:
+                for arcname in sorted(set(files) - set(cached)):
+                    self._add(zf, files[arcname][0], arcname)
+            os.replace(tmp_path, self.path)
+            self._save_index(etag, files)
+            logging.info(f"/download_content archive: appended {len(files) - len(cached)} file(s)")
+            return True
+        finally:
+            self._lock.release()
+
+    def stream(self, files, etag):
+        """Generator yielding the zip one file at a time, rebuilding the cached archive if nobody else is."""
+        cache_file = open(self.path + ".tmp", "wb") if self._lock.acquire(blocking=False) else None
+        complete, included = False, {}
+        try:
+            sink = ArchiveSink(cache_file)
+            with zipfile.ZipFile(sink, "w") as zf:
+                for arcname in sorted(files):
+                    try:
+                        self._add(zf, files[arcname][0], arcname)
+                    except OSError:
+                        continue  # Removed while streaming
+                    included[arcname] = files[arcname]
+                    yield sink.drain()
+            yield sink.drain()
+            complete = True
+        finally:
+            if cache_file is not None:
+                cache_file.close()
+                if complete:
+                    os.replace(self.path + ".tmp", self.path)
+                    self._save_index(etag if included == files else None, included)
+                else:
+                    os.remove(self.path + ".tmp")
+                self._lock.release()
+
+
+content_archive = ContentArchive()
+
 ##################################################################
 # QUERY - RETURN (DOWNLOAD) ALL CONTENT
 @app.route("/download_content")
 def download_content():
-    zip_buffer = io.BytesIO()
-
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
-        for root, _, files in os.walk(UPLOAD_FOLDER):
-            for filename in files:
-                filepath = os.path.join(root, filename)
-                # Add file to zip with relative path
-                arcname = os.path.relpath(filepath, start=UPLOAD_FOLDER)
-                zipf.write(filepath, arcname=arcname)
-
-    zip_buffer.seek(0)
-    return send_file(
-        zip_buffer,
-        mimetype="application/zip",
-        as_attachment=True,
-        download_name="uploaded_content.zip"
-    )
+    # Weak ETag: it hashes the file listing, not the zip bytes (a streamed and a cached archive differ byte-wise)
+    files, etag = content_archive.scan()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+
+    if content_archive.is_current(etag):
+        status = "HIT"
+    elif content_archive.try_append(files, etag):
+        status = "APPEND"
+    else:
+        response = Response(content_archive.stream(files, etag), mimetype="application/zip")
+        response.headers["Content-Disposition"] = "attachment; filename=uploaded_content.zip"
+        status = "STREAM"
+
+    if status != "STREAM":
+        response = send_file(
+            content_archive.path,
+            mimetype="application/zip",
+            as_attachment=True,
+            download_name="uploaded_content.zip",
+            conditional=False,
+            etag=False
+        )
+    response.set_etag(etag, weak=True)
+    response.headers["X-Cache"] = status
+    return response
 
 ##################################################################
 # QUERY - FETCH DIR (LISTING OF FILES)
 @app.route("/show_dir")
 def show_dir():
-    base_path = "."  # Start from current working directory
-    file_list = []
-
-    for root, dirs, files in os.walk(base_path):
-        for name in files:
-            full_path = os.path.join(root, name)
-            try:
-                size = os.path.getsize(full_path)
-            except OSError:
-                size = -1  # Could not access file size
+    # ?prefix=uploaded_files/ &sort=name|size|mtime &order=asc|desc &offset= &limit= &format=json
+    prefix = request.args.get("prefix", "")
+    sort = request.args.get("sort", "name")
+    if sort not in ("name", "size", "mtime"):
+        return f"Unknown sort '{sort}' (expected one of name, size, mtime)", 400
+    try:
+        offset = max(0, int(request.args.get("offset", 0)))
+        limit = max(0, int(request.args.get("limit", 1000)))
+    except ValueError:
+        return "offset and limit must be integers", 400
+
+    entries = file_index.listing(prefix, sort, reverse=request.args.get("order") == "desc")
+    page = entries[offset:offset + limit]
+
+    if request.args.get("format") == "json":
+        return jsonify({
+            "total": len(entries),
+            "offset": offset,
+            "limit": limit,
+            "files": [{"path": path, "size": size, "mtime": datetime.utcfromtimestamp(mtime).isoformat()}
+                      for path, size, mtime in page],
+        })
+    output = "\n".join(f"{path} ({size} bytes)" for path, size, _ in page)
+    return Response(f"<pre>{output}</pre>", mimetype="text/html")
 
-            relative_path = os.path.relpath(full_path, start=base_path)
-            file_list.append(f"{relative_path} ({size} bytes)")
 
-    file_list.sort()
-    output = "\n".join(file_list)
+##################################################################
+# FUNCTION - CROP IMAGES
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Process pool for image decoding / cropping / encoding (CPU-bound, holds the GIL).
+# Not used under gevent: ProcessPoolExecutor's patched management thread and queues deadlock there
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", str(os.cpu_count() or 1)))
+IMAGE_POOL_MIN_IMAGES = int(os.getenv("IMAGE_POOL_MIN_IMAGES", "6"))  # smaller documents stay in-process
+IMAGE_POOL_TIMEOUT = float(os.getenv("IMAGE_POOL_TIMEOUT", "30"))  # seconds per image
+IMAGE_POOL_WINDOW = int(os.getenv("IMAGE_POOL_WINDOW", str(2 * IMAGE_POOL_WORKERS)))  # images in flight per document
+image_pool_lock = threading.Lock()
+image_pool_state = {"pool": None}
+
+
+def get_image_pool():
+    # Workers never fork this process (its threads, locks and the scheduler lock): they come from the forkserver,
+    # a fresh interpreter that only imports imaging.py, or are spawned where forkserver is unavailable
+    with image_pool_lock:
+        if image_pool_state["pool"] is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["imaging"])
+            else:
+                context = multiprocessing.get_context("spawn")
+            image_pool_state["pool"] = ProcessPoolExecutor(max_workers=IMAGE_POOL_WORKERS, mp_context=context)
+        return image_pool_state["pool"]
 
-    for root, dirs, files in os.walk(base_path):
-        for name in files:
-            full_path = os.path.join(root, name)
-            file_list.append(os.path.relpath(full_path, start=base_path))
 
-    file_list.sort()
-    output = "\n".join(file_list)
-    return Response(f"<pre>{output}</pre>", mimetype="text/html")
+def reset_image_pool(kill=False):
+    # A worker killed mid-task breaks the whole executor: start a new one next time.
+    # kill: also stop the workers, since a task already running (e.g. stuck past its timeout) cannot be cancelled
+    with image_pool_lock:
+        pool, image_pool_state["pool"] = image_pool_state["pool"], None
+    if pool is None:
+        return
+    processes = list((pool._processes or {}).values()) if kill else []
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.kill()
 
 
-##################################################################
-# FUNCTION - CROP IMAGES
-def extract_cropped_images_proportional(docx_path, output_dir, logo_details):
-    all_extensions = tuple(['.png', '.jpg', '.jpeg', '.gif', '.tif', '.tiff','.bmp','.emf','.wmf','.svg','.ico'])
+class CroppedImages:
+    """
+    Crops of the images of one .docx, produced on demand while mammoth walks the document.
+    - layout: {image name: {"path": zip member, "crop": (l, t, r, b) in 1/100000 of the size or None,
+                            "extent": (cx, cy) EMU or None, "replace": local file used instead or None}}
+    - each image is decoded only when mammoth asks for it, one at a time, and released right after encoding
+    - with IMAGE_OPTIMIZE, images are downscaled to their rendered width (x IMAGE_HIDPI_SCALE) and photos
+      re-encoded as IMAGE_FORMAT at IMAGE_QUALITY; palette / few-colour images (logos, line art) stay PNG
+    - encoded results are kept in a LRU bounded by `max_bytes` for images referenced several times
+    - an image that cannot be decoded, is too large or would not get smaller is passed through unchanged
+    - prefetch() hands the images to the image pool when the document is large enough, in layout order and at most
+      IMAGE_POOL_WINDOW at a time ahead of mammoth, so only that many originals and results are held outside the LRU;
+      under gevent the images are always cropped in-process
+    - a pooled image that times out is published unchanged and the pool is recycled, as its task cannot be cancelled
+    """
+    def __init__(self, layout, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.layout = layout
+        self.max_bytes = max_bytes
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._docx_path = None
+        self._ahead = deque()  # names still to submit to the pool
+        self._inflight = OrderedDict()  # name -> future
+        self.decoded = 0
+        self.reused = 0
+        self.seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.pooled = 0
+        self.pool_failures = 0
+
+    def _account(self, data, result):
+        self.bytes_in += len(data)
+        self.bytes_out += len(result[0])
+
+    def prefetch(self, docx_path):
+        """Start processing the images on the image pool, in layout order, before mammoth runs."""
+        names = [name for name, layout in self.layout.items() if layout["replace"] is None]
+        if IMAGE_POOL_WORKERS <= 1 or len(names) < IMAGE_POOL_MIN_IMAGES or gevent_patched():
+            return False
+        self._docx_path = docx_path
+        self._ahead.extend(names)
+        self._submit_ahead()
+        return True
+
+    def _submit_ahead(self):
+        if not self._ahead or len(self._inflight) >= IMAGE_POOL_WINDOW:
+            return
+        pool = get_image_pool()
+        with zipfile.ZipFile(self._docx_path, 'r') as z:
+            while self._ahead and len(self._inflight) < IMAGE_POOL_WINDOW:
+                name = self._ahead.popleft()
+                self._inflight[name] = pool.submit(process_image, z.read(self.layout[name]["path"]), self.layout[name])
+
+    def _from_pool(self, image_name):
+        """(bytes, content type or None) processed by the image pool, or None if the pool failed on this image."""
+        future = self._inflight.pop(image_name)
+        start = time.perf_counter()
+        try:
+            processed, processed_type, decoded = future.result(timeout=IMAGE_POOL_TIMEOUT)
+        except Exception as e:
+            # Timeout, undecodable image or broken pool: publish the original image
+            logging.info(f"Failed cropping {image_name} in image pool: {e!r}")
+            self.pool_failures += 1
+            if isinstance(e, (TimeoutError, BrokenProcessPool)):
+                reset_image_pool(kill=True)
+                # The other images in flight went down with the pool: submit them again to the new one
+                self._ahead.extendleft(reversed(self._inflight))
+                self._inflight.clear()
+            return None
+        finally:
+            metrics.observe("stage_duration_seconds", time.perf_counter() - start, stage="image_crop_pool")
+        self.decoded += decoded
+        self.pooled += 1
+        return processed, processed_type
+
+    def get(self, image_name, data, content_type):
+        """Return (bytes, content type) to publish for an embedded image given its original bytes."""
+        if image_name in self._cache:
+            self.reused += 1
+            self._cache.move_to_end(image_name)
+            return self._cache[image_name]
+        layout = self.layout.get(image_name)
+        start = time.perf_counter()
+        result = (data, content_type)
+        if image_name in self._inflight:
+            pooled = self._from_pool(image_name)
+            if pooled is not None:
+                result = (pooled[0], pooled[1] or content_type)
+        elif layout is not None and layout["replace"] is not None:
+            result = (Path(layout["replace"]).read_bytes(), Image.MIME.get(Image.open(layout["replace"]).format))
+        elif layout is not None:
+            if image_name in self._ahead:
+                self._ahead.remove(image_name)  # Asked for out of layout order: no need to pool it any more
+            try:
+                with metrics.time("image_crop"):
+                    processed, processed_type, decoded = process_image(data, layout)
+                self.decoded += decoded
+                result = (processed, processed_type or content_type)
+            except Exception as e:
+                logging.info(f"Failed cropping {image_name}: {str(e)}")
+        self.seconds += time.perf_counter() - start
+        self._account(data, result)
+        self._cache[image_name] = result
+        self._cached_bytes += len(result[0])
+        while self._cached_bytes > self.max_bytes and len(self._cache) > 1:
+            _, (evicted, _) = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+        self._submit_ahead()
+        return result
+
+
+def extract_cropped_images_proportional(docx_path, logo_details):
+    """Read the crop and layout of every referenced image from document.xml; no image is decoded here."""
     ns = {
         "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
         "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
@@ -351,95 +2454,85 @@ def extract_cropped_images_proportional(docx_path, output_dir, logo_details):
     with zipfile.ZipFile(docx_path, 'r') as z:
         doc_xml = etree.fromstring(z.read("word/document.xml"))
         rels_xml = etree.fromstring(z.read("word/_rels/document.xml.rels"))
+        media_names = {name for name in z.namelist() if name.startswith("word/media/")}
 
-        # Map relationship IDs to image filenames
-        rel_map = {
-            rel.attrib["Id"]: rel.attrib["Target"]
-            for rel in rels_xml.findall(".//pr:Relationship", namespaces=rels_ns)
-            if "Target" in rel.attrib and rel.attrib["Target"].startswith("media/")
-        }
-
-        # Load media binaries
-        media_files = {
-            name: z.read(name)
-            for name in z.namelist()
-
-            if name.startswith("word/media/") and name.lower().endswith(all_extensions)
-        }
-
-        results = []
+    # Map relationship IDs to image filenames
+    rel_map = {
+        rel.attrib["Id"]: rel.attrib["Target"]
+        for rel in rels_xml.findall(".//pr:Relationship", namespaces=rels_ns)
+        if "Target" in rel.attrib and rel.attrib["Target"].startswith("media/")
+    }
 
-        # Iterate over image references
-        for blip in doc_xml.findall(".//a:blip", namespaces=ns):
-            rid = blip.attrib.get("{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed")
-            if rid not in rel_map:
-                continue
+    layout = {}
 
-            image_name = rel_map[rid].split("/")[-1]
-            image_path = f"word/{rel_map[rid]}"
-            if image_path not in media_files:
-                continue
-            if (Path(image_path).suffix.lower()=='.XXXXwmf') :
-                results.append([image_name, Path(logo_GIF)])
-            else:
-                try:
-                    img = Image.open(io.BytesIO(media_files[image_path])).convert("RGB")
-                except:
-                    print('Image %s skipped' % image_name)
-                    results.append((image_name, Path(output_dir)/Path(image_path)))
-                else:
-                    width_px, height_px = img.size
-
-                    # Locate cropping and layout size
-                    srcRect = blip.getparent().find("a:srcRect", namespaces=ns)
-                    xfrm = blip.getparent().getparent().find(".//a:xfrm", namespaces=ns)
-                    if srcRect is None or xfrm is None:
-                        results.append(image_path)
-                        continue
-                    width_px, height_px = img.size
-                    data_crop = {k: int(srcRect.attrib.get(k, "0")) for k in ["l", "r", "t", "b"]}
-                    crop_x1 = int(data_crop['l']*width_px/100000)
-                    crop_y1 = int(data_crop['t']*height_px/100000)
-                    crop_x2 = int((1-data_crop['r']/100000)*width_px)
-                    crop_y2 = int((1-data_crop['b']/100000)*height_px)
-                    cropped = img.crop((crop_x1, crop_y1,crop_x2,crop_y2))
+    # Iterate over image references
+    for blip in doc_xml.findall(".//a:blip", namespaces=ns):
+        rid = blip.attrib.get("{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed")
+        if rid not in rel_map:
+            continue
 
-                    try:
-                        out_path = f"{output_dir}/{image_name.replace('.', '_cropped.')}"
-                        cropped.save(out_path)
-                        results.append((image_name, out_path))
-                    except Exception as e:
-                        print(f"Failed cropping {image_name}: {e}")
-                        continue
+        image_name = rel_map[rid].split("/")[-1]
+        image_path = f"word/{rel_map[rid]}"
+        if image_path not in media_names:
+            continue
+        if (Path(image_path).suffix.lower()=='.XXXXwmf') :
+            layout[image_name] = {"path": image_path, "crop": None, "extent": None, "replace": logo_GIF}
+            continue
 
-        return results
+        # Locate cropping and layout size
+        srcRect = blip.getparent().find("a:srcRect", namespaces=ns)
+        xfrm = blip.getparent().getparent().find(".//a:xfrm", namespaces=ns)
+        crop, extent = None, None
+        if xfrm is not None:
+            ext = xfrm.find("a:ext", namespaces=ns)
+            if ext is not None:
+                extent = (int(ext.attrib.get("cx", "0")), int(ext.attrib.get("cy", "0")))
+            if srcRect is not None:
+                crop = tuple(int(srcRect.attrib.get(k, "0")) for k in ["l", "t", "r", "b"])
+        if crop is not None or image_name not in layout:
+            layout[image_name] = {"path": image_path, "crop": crop, "extent": extent, "replace": None}
+
+    return CroppedImages(layout)
 
 ##################################################################
 # FUNCTION - CONVERT WORD FILE INTO HTML
-def convert_docx_to_html_with_cropped_images(docx_path, output_html_path, pic_file_mapping):
+def image_data_uri(data, content_type):
+    b64 = base64.b64encode(data).decode("utf-8")
+    return f"data:{content_type};base64,{b64}"
+
+
+def convert_docx_to_html_with_cropped_images(docx_path, output_html_path, cropped_images, hosted_images=None):
     """
     Parameters:
     - docx_path: path to the original .docx file
-    - cropped_image_map: dict mapping image names like 'image1.jpeg' to full paths of cropped versions
     - output_html_path: where to save the final HTML
+    - cropped_images: CroppedImages returned by extract_cropped_images_proportional()
+    - hosted_images: HostedImages to reference images by B2 URL, or None to inline them as base64
     """
     def convert_image(image):
-        image_file_name = Path(image.open().thing.name).name
-        image_file_use = pic_file_mapping[image_file_name]
-        try:
-            ext = Path(image_file_use).suffix[1:]
-            with open(image_file_use, "rb") as f:
-                b64 = base64.b64encode(f.read()).decode("utf-8")
-            return {"src": f"data:image/{ext};base64,{b64}"}
-        except StopIteration:
-            print("⚠️ More images in DOCX than available cropped images. Falling back.")
-            return {}
+        try:
+            # Streamed from the .docx only now that mammoth references it
+            with image.open() as stream:
+                image_file_name = Path(stream.name).name
+                data = stream.read()
+            data, content_type = cropped_images.get(image_file_name, data, image.content_type)
+            if hosted_images is not None:
+                try:
+                    return {"src": hosted_images.url(data, content_type)}
+                except Exception as e:
+                    print(f"⚠️ Image hosting unavailable, inlining: {e}")
+            return {"src": image_data_uri(data, content_type)}
         except Exception as e:
             print(f"⚠️ Error processing image: {e}")
             return {}
 
-    result = mammoth.convert_to_html(docx_path, convert_image=mammoth.images.inline(convert_image))
+    with metrics.time("mammoth_convert"):
+        result = mammoth.convert_to_html(docx_path, convert_image=mammoth.images.inline(convert_image))
     html = result.value
+    if hosted_images is not None:
+        # Images whose upload failed fall back to inlining
+        for url, (data, content_type) in hosted_images.wait().items():
+            html = html.replace(url, image_data_uri(data, content_type))
 
     html_wrapped = f"""<!DOCTYPE html>
         <html lang="fr">
@@ -474,48 +2567,285 @@ def convert_docx_to_html_with_cropped_images(docx_path, output_html_path, pic_fi
 
 
 ##################################################################
-# QUERY - RECEIVE WORD FILE AND PROCESS INTO HTML
+# FUNCTION - WORD FILE TO PUBLISHED HTML (RUN BY THE JOB QUEUE)
+def process_word_file(docx_path, timestamp, stage, image_mode=IMAGE_MODE):
+    """
+    Crop images, convert to HTML and publish a saved .docx.
+    - stage: context manager factory timing each named step (see JobQueue)
+    - image_mode: 'inline' (base64 in the HTML) or 'hosted' (content-addressed files on B2)
+    Returns the job output: {"html": local path, "latest": local path, "remote": B2 name, "images": crop stats}
+    """
+    # Step c: Generate HTML output paths
+    html_filename = f"{timestamp}.html"
+    html_path = os.path.join(HTML_FOLDER, html_filename)
+    latest_path = os.path.join(HTML_FOLDER, "latest_html.html")
+
+    logo_details = (392860, "logo_paroisse2.gif")  # Placeholder — replace if dynamic
+
+    # Process document: images are cropped in memory while mammoth converts
+    with stage("image_layout"):
+        cropped_images = extract_cropped_images_proportional(docx_path, logo_details)
+    with stage("crop_images"):
+        cropped_images.prefetch(docx_path)
+    hosted_images = HostedImages() if image_mode == "hosted" else None
+    with stage("convert_html"):
+        html = convert_docx_to_html_with_cropped_images(docx_path, html_path, cropped_images, hosted_images)
+
+        # Also write to latest_html.html
+        with open(latest_path, "w", encoding="utf-8") as f:
+            f.write(html)
+        file_index.touch(html_path, latest_path)
+        publish_artifact(latest_path)
+    images = {"referenced": len(cropped_images.layout), "decoded": cropped_images.decoded,
+              "reused": cropped_images.reused, "crop_seconds": round(cropped_images.seconds, 3),
+              "pooled": cropped_images.pooled, "pool_failures": cropped_images.pool_failures,
+              "bytes_before": cropped_images.bytes_in, "bytes_after": cropped_images.bytes_out, "mode": image_mode}
+    if hosted_images is not None:
+        images.update({"hosted_uploaded": hosted_images.uploaded, "hosted_skipped": hosted_images.skipped})
+    logging.info(f"/deliver_word images {images}")
+
+    # Push the HTML file to the BlackBlaze server
+    with stage("upload_b2"):
+        publish_b2_file(latest_path, 'bulletin_paroissial.html')
+
+    return {"html": html_path, "latest": latest_path, "remote": "bulletin_paroissial.html", "images": images}
+
+##################################################################
+# BACKGROUND JOB QUEUE FOR WORD CONVERSIONS (PERSISTED)
+JOBS_DB_PATH = "jobs.sqlite3"
+JOBS_LEGACY_PATH = "jobs.json"  # imported once, then removed
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "200"))  # finished jobs kept
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))  # idle workers look for jobs of other processes
+
+
+class JobQueue:
+    """
+    Bounded pool of OS threads (native even under gevent, so a CPU-bound conversion never stalls the
+    hub serving requests) running deliver_word conversions outside the request.
+    Jobs are rows of jobs.sqlite3 (WAL, shared by the gunicorn workers), one per job:
+    {"id", "state", "file", "docx", "timestamp", "image_mode", "created", "started", "finished",
+     "stages": {name: seconds}, "output", "error"}
+    - states go queued -> running -> done | failed; a worker claims the oldest queued job inside
+      BEGIN IMMEDIATE, so each job runs in exactly one process whichever worker received the upload
+    - a running job whose owner process is gone (crash, restart, deploy) is queued again by the first
+      worker that looks, in the same transaction, since its .docx is already saved in uploaded_word/
+    - only the JOB_HISTORY most recent finished jobs are kept
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            file TEXT NOT NULL,
+            docx TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            image_mode TEXT NOT NULL,
+            created REAL NOT NULL,
+            started REAL,
+            finished REAL,
+            stages TEXT NOT NULL DEFAULT '{}',
+            output TEXT,
+            error TEXT,
+            owner TEXT
+        );
+        CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created);
+    """
+    JSON_FIELDS = ("stages", "output")
+
+    def __init__(self, path=JOBS_DB_PATH, workers=JOB_WORKERS):
+        self.path = path
+        # Used from the native job threads and from request greenlets
+        self._lock = native_thread_api("allocate_lock")()
+        # Released by submit() to wake an idle worker of this process before its next poll
+        self._wake = native_thread_api("allocate_lock")()
+        self._wake.acquire()
+        # "pid:token": the token tells a dead owner apart from a new process that got the same pid
+        self.owner = f"{os.getpid()}:{os.urandom(4).hex()}"
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(self.SCHEMA)
+        self._import_legacy()
+        for _ in range(workers):
+            native_thread_api("start_new_thread")(self._work, ())
+
+    def _import_legacy(self, legacy_path=JOBS_LEGACY_PATH):
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                jobs = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            for job in jobs.values():
+                if job["state"] == "running":
+                    job["state"] = "queued"
+                self._insert(dict(job, image_mode=job.get("image_mode", IMAGE_MODE)), replace=False)
+        os.remove(legacy_path)
+        logging.info(f"Jobs: imported {len(jobs)} jobs from {legacy_path}")
+
+    def _insert(self, job, replace=True):
+        # Caller holds self._lock
+        fields = [field for field in job if field != "owner"]
+        values = [json.dumps(job[field], ensure_ascii=False) if field in self.JSON_FIELDS else job[field]
+                  for field in fields]
+        self._db.execute(f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO jobs ({', '.join(fields)}) "
+                         f"VALUES ({', '.join('?' * len(fields))})", values)
+
+    def _job(self, cursor, record):
+        job = dict(zip((column[0] for column in cursor.description), record))
+        job.pop("owner", None)
+        for field in self.JSON_FIELDS:
+            if job[field] is not None:
+                job[field] = json.loads(job[field])
+        return job
+
+    def _owner_alive(self, owner):
+        pid, _, token = (owner or "").partition(":")
+        if not pid.isdigit():
+            return False
+        if int(pid) == os.getpid():
+            return owner == self.owner
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _claim(self):
+        """Oldest queued job, now running in this process (None if there is nothing to do)."""
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM jobs WHERE state IN ('queued', 'running') LIMIT 1").fetchone() is None:
+                return None
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for job_id, owner in self._db.execute("SELECT id, owner FROM jobs WHERE state = 'running'").fetchall():
+                    if not self._owner_alive(owner):
+                        logging.info(f"Job {job_id} recovered from stopped process {owner}")
+                        self._db.execute("UPDATE jobs SET state = 'queued', owner = NULL WHERE id = ?", (job_id,))
+                cursor = self._db.execute("SELECT * FROM jobs WHERE state = 'queued' ORDER BY created LIMIT 1")
+                record = cursor.fetchone()
+                job = self._job(cursor, record) if record is not None else None
+                if job is not None:
+                    job.update(state="running", started=time.time(), stages={})
+                    self._db.execute("UPDATE jobs SET state = 'running', started = ?, stages = '{}', owner = ? "
+                                     "WHERE id = ?", (job["started"], self.owner, job["id"]))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return job
+
+    def _update(self, job, **fields):
+        job.update(fields)
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {', '.join(f'{field} = ?' for field in fields)} WHERE id = ?",
+                             [json.dumps(value, ensure_ascii=False) if field in self.JSON_FIELDS else value
+                              for field, value in fields.items()] + [job["id"]])
+            if job["state"] in ("done", "failed"):
+                self._db.execute("DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE state IN ('done', 'failed') "
+                                 "ORDER BY created DESC LIMIT -1 OFFSET ?)", (JOB_HISTORY,))
+
+    def submit(self, docx_path, timestamp, filename, image_mode=IMAGE_MODE):
+        job_id = f"{timestamp}_{os.urandom(3).hex()}"
+        with self._lock:
+            self._insert({
+                "id": job_id, "state": "queued", "file": filename, "docx": docx_path, "timestamp": timestamp,
+                "image_mode": image_mode, "created": time.time(),
+            })
+        try:
+            self._wake.release()
+        except RuntimeError:
+            pass  # A wake-up is already pending
+        return job_id
+
+    def _work(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                logging.info(f"Jobs: claim failed {str(e)}")
+                job = None
+            if job is None:
+                self._wake.acquire(timeout=JOB_POLL_SECONDS)
+                continue
+            try:
+                self._run(job)
+            except Exception as e:
+                # Bookkeeping failed (jobs.sqlite3 or the upload log): keep this worker alive for the next jobs
+                logging.info(f"Job {job['id']} failed outside the conversion: {str(e)}")
+                try:
+                    self._update(job, state="failed", finished=time.time(), error=str(e))
+                except Exception as e:
+                    logging.info(f"Jobs: could not mark {job['id']} failed {str(e)}")
+
+    def _run(self, job):
+        @contextmanager
+        def stage(name):
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self._update(job, stages={**job["stages"], name: round(time.perf_counter() - start, 3)})
+
+        try:
+            output = process_word_file(job["docx"], job["timestamp"], stage, job["image_mode"])
+        except Exception as e:
+            self._update(job, state="failed", finished=time.time(), error=str(e))
+            log_upload("FAIL", job["file"], str(e))
+        else:
+            self._update(job, state="done", finished=time.time(), output=output)
+            log_upload("SUCCESS", job["file"])
+        logging.info(f"Job {job['id']} {job['state']} in {round(job['finished'] - job['started'], 1)} s {job['stages']}")
+
+    def get(self, job_id):
+        with self._lock:
+            cursor = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            record = cursor.fetchone()
+            return self._job(cursor, record) if record is not None else None
+
+    def pending(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('queued', 'running')").fetchone()[0]
+
+
+job_queue = JobQueue(workers=JOB_WORKERS if BACKGROUND_WORK else 0)
+
+##################################################################
+# QUERY - RECEIVE WORD FILE AND QUEUE ITS CONVERSION INTO HTML
 @app.route("/deliver_word", methods=["POST"])
 def deliver_word():
     uploaded_file = request.files.get("file")
     if not uploaded_file:
         log_upload("FAIL", "unknown", "No file uploaded")
         return "No file uploaded", 400
+    # ?images=inline|hosted (query string or form field)
+    image_mode = request.values.get("images", IMAGE_MODE)
+    if image_mode not in IMAGE_MODES:
+        return f"Unknown images mode '{image_mode}' (expected one of {', '.join(IMAGE_MODES)})", 400
 
     # Step a: Save uploaded .docx file with timestamp
     timestamp = datetime.utcnow().strftime("%Y_%m_%d_%H_%M_%S")
     filename = f"{timestamp}.docx"
     docx_path = os.path.join(WORD_FOLDER, filename)
     uploaded_file.save(docx_path)
+    file_index.touch(docx_path)
 
-    try:
-        # Step b: Create temp output directory for cropped images
-        with tempfile.TemporaryDirectory() as output_dir:
-            # Step c: Generate HTML output paths
-            html_filename = f"{timestamp}.html"
-            html_path = os.path.join(HTML_FOLDER, html_filename)
-            latest_path = os.path.join(HTML_FOLDER, "latest_html.html")
-
-            logo_details = (392860, "logo_paroisse2.gif")  # Placeholder — replace if dynamic
-
-            # Process document
-            results = extract_cropped_images_proportional(docx_path, output_dir, logo_details)
-            results_dict = {k[0]: k[1] for k in results}
-            html = convert_docx_to_html_with_cropped_images(docx_path, html_path, results_dict)
-
-            # Also write to latest_html.html
-            with open(latest_path, "w", encoding="utf-8") as f:
-                f.write(html)
-
-            # Push the HTML file to the BlackBlaze server
-            push_b2_file(latest_path, 'bulletin_paroissial.html')
+    job_id = job_queue.submit(docx_path, timestamp, filename, image_mode)
+    log_upload("QUEUED", filename, f"job {job_id}")
+    return jsonify({"job_id": job_id, "state": "queued", "status_url": f"/jobs/{job_id}"}), 202
 
-            log_upload("SUCCESS", filename)
-            return f"✅ Processed and saved: {html_filename}", 200
-
-    except Exception as e:
-        log_upload("FAIL", filename, str(e))
-        return f"❌ Error processing file: {str(e)}", 500
+##################################################################
+# QUERY - STATUS OF A WORD CONVERSION JOB
+@app.route("/jobs/<job_id>")
+def show_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return f"Unknown job '{job_id}'", 404
+    if job["started"] is not None:
+        end = job["finished"] or time.time()
+        job["elapsed"] = round(end - job["started"], 3)
+    return jsonify(job)
 
 ##################################################################
 # QUERY - RETURN LATEST HTML
@@ -526,7 +2856,7 @@ def latest_word_html():
     if not os.path.exists(latest_path):
         return "No HTML has been generated yet.", 404
 
-    return send_file(latest_path, mimetype="text/html")
+    return serve_artifact(latest_path, "text/html")
 
 ##################################################################
 # SUBFUNCTION FOR READINGS: DATE OP NEXT SUNDAY
@@ -540,106 +2870,264 @@ def get_next_sunday():
 ##################################################################
 # SUBFUNCTION FOR READINGS: GIVE CURRENT URL TO READ
 
-def get_current_readings_URL():
+def get_readings_URL(day):
     base_url = "https://levangileauquotidien.org/FR/gospel/"
-    return base_url + get_next_sunday()
+    return base_url + day
+
+
+def get_current_readings_URL():
+    return get_readings_URL(get_next_sunday())
 
 
 ##################################################################
 # SUB-FUNCTION TO FETCH READINGS VIA CHROMIUM
 
-async def readings_extract_all_sections(url):
+READINGS_WAIT_UNTIL = os.getenv("READINGS_WAIT_UNTIL", "domcontentloaded")  # commit, domcontentloaded, load, networkidle
+READINGS_BLOCKED_RESOURCES = set(os.getenv(
+    "READINGS_BLOCKED_RESOURCES",
+    "image,media,font,stylesheet,texttrack,eventsource,websocket,manifest,other").split(","))
+READINGS_BLOCK_THIRD_PARTY = os.getenv("READINGS_BLOCK_THIRD_PARTY", "1") == "1"  # ads, analytics, trackers
+READINGS_SITE = "levangileauquotidien.org"
+
+# Everything the readings page gives us, collected in the browser in one round trip
+READINGS_EXTRACT_JS = """
+() => {
+    const text = el => (el ? el.innerText : "");
+    const sections = Array.from(document.querySelectorAll("h2")).map(title => {
+        const parent = title.parentElement;
+        return {
+            title: text(title),
+            reference: text(parent && parent.querySelector("h3")),
+            text: text(parent && parent.parentElement && parent.parentElement.querySelector(".reading-text")),
+        };
+    });
+    const comment = document.querySelector("div.comment-text");
+    return {sections: sections, commentary: comment ? comment.innerText : null};
+}
+"""
+
+
+async def readings_block_resources(route):
+    request = route.request
+    third_party = READINGS_BLOCK_THIRD_PARTY and not (urlsplit(request.url).hostname or "").endswith(READINGS_SITE)
+    if request.resource_type in READINGS_BLOCKED_RESOURCES or (third_party and request.resource_type != "document"):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def readings_extract_all_sections(url, wait_until=None):
     logging.info("/fetch_readings async started")
+    start = time.perf_counter()
+    transferred, blocked, size_tasks = [0], [0], []
+
+    async def count_bytes(req):
+        sizes = await req.sizes()
+        transferred[0] += sizes["responseHeadersSize"] + sizes["responseBodySize"]
+
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
+        async with browser_pool.context() as context:
+            await context.route("**/*", readings_block_resources)
+            page = await context.new_page()
+            page.on("requestfinished", lambda req: size_tasks.append(asyncio.ensure_future(count_bytes(req))))
+            page.on("requestfailed", lambda req: blocked.__setitem__(0, blocked[0] + 1))
             logging.info("/fetch_readings async opening URL")
-            await page.goto(url)
+            with metrics.time("page_goto"):
+                await page.goto(url, wait_until=wait_until or READINGS_WAIT_UNTIL)
             logging.info("/fetch_readings async opened URL")
-            await page.wait_for_selector("h2")
+            with metrics.time("selector_wait"):
+                await page.wait_for_selector("h2")
             logging.info("/fetch_readings async selector")
 
-            # Get all h2s (titles of sections like Première lecture, Cantique, etc.)
-            titles = await page.query_selector_all("h2")
-            result = []
-
-            for title_el in titles:
-                logging.info("/fetch_readings async title " + str(title_el))
-                title_text = await title_el.inner_text()
-
-                # Get the next sibling: h3 for reference
-                parent = await title_el.evaluate_handle("node => node.parentElement")
-                h3 = await parent.query_selector("h3")
-                reference = await h3.inner_text() if h3 else ""
-
-                # Now get the div.reading-text that follows the title
-                # We'll look for the next sibling with that class
-                reading_text_el = await parent.evaluate_handle('node => node.parentElement.querySelector(".reading-text")')
-                text = await reading_text_el.inner_text() if reading_text_el else ""
-
-                result.append({
-                    "title": title_text,
-                    "reference": reference,
-                    "text": text
-                })
-
-            # Get the commentary separately
-            comment_el = await page.query_selector("div.comment-text")
-            commentary = await comment_el.inner_text() if comment_el else "(Pas de commentaire trouvé)"
+            # Titles (Première lecture, Cantique, etc.), their h3 reference, reading text and the commentary
+            extracted = await page.evaluate(READINGS_EXTRACT_JS)
+            result = extracted["sections"]
             result.append({
                 "title": "Commentaire",
                 "reference": "",
-                "text": commentary
+                "text": extracted["commentary"] if extracted["commentary"] is not None else "(Pas de commentaire trouvé)"
             })
+            await asyncio.gather(*size_tasks, return_exceptions=True)
 
-            await browser.close()
-            return result
+        logging.info(f"/fetch_readings scraped {len(result) - 1} sections in "
+                     f"{round(1000 * (time.perf_counter() - start))} ms, {transferred[0]} bytes transferred, "
+                     f"{blocked[0]} requests blocked or failed")
+        return result
     except:
         return None
 
+##################################################################
+# READINGS STORE (KEYED BY LITURGICAL DATE)
+READINGS_STORE_PATH = "readings_store.json"
+READINGS_MIN_SECTIONS = 4  # 1e lecture, Psaume, 2e lecture, Evangile
+READINGS_PREFETCH_WEEKS = int(os.getenv("READINGS_PREFETCH_WEEKS", "3"))
+READINGS_KEEP_DAYS = int(os.getenv("READINGS_KEEP_DAYS", "28"))  # older Sundays are dropped from the store
+READINGS_QUIET_HOURS = tuple(int(h) for h in os.getenv("READINGS_QUIET_HOURS", "1-6").split("-"))  # Paris time
+
+
+def readings_complete(readings):
+    """At least the four readings with some text (the last entry is always the commentary)."""
+    return readings is not None and sum(bool(r["text"].strip()) for r in readings[:-1]) >= READINGS_MIN_SECTIONS
+
+
+class ReadingsStore:
+    """
+    Scraped readings per Sunday, persisted in readings_store.json and shared by the gunicorn workers:
+    {"entries": {"YYYY-MM-DD": {"readings": [{"title", "reference", "text"}], "fetched_at"}}, "published": date}
+    "published" is the Sunday currently in readings_current.html / lectures.html.
+    - reads reload the file once another worker replaced it, so every worker sees the published day and prefetches
+    - writes re-read the file and apply their change under an exclusive lock on readings_store.json.lock,
+      so a worker never overwrites entries it has not seen
+    - Sundays older than READINGS_KEEP_DAYS are dropped on write, except the published one
+    """
+    def __init__(self, path=READINGS_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._prefetching = False
+        self._mtime = None
+        self.entries, self._published = {}, None
+        self._reload()
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime:
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.entries, self._published, self._mtime = state["entries"], state["published"], mtime
+        except (OSError, ValueError, KeyError):
+            pass
+
+    @contextmanager
+    def _updating(self):
+        """Reload, let the caller change entries / published, prune and save, as one step across workers."""
+        with self._lock, open(self.path + ".lock", "a") as lock_file:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            self._mtime = None
+            self._reload()
+            yield
+            oldest = (date.today() - timedelta(days=READINGS_KEEP_DAYS)).strftime("%Y-%m-%d")
+            self.entries = {day: entry for day, entry in self.entries.items()
+                            if day >= oldest or day == self._published}
+            write_json_atomic(self.path, {"entries": self.entries, "published": self._published})
+            self._mtime = os.stat(self.path).st_mtime_ns
+
+    @property
+    def published(self):
+        self._reload()
+        return self._published
+
+    def get(self, day):
+        self._reload()
+        entry = self.entries.get(day)
+        return entry["readings"] if entry is not None else None
+
+    def is_complete(self, day):
+        return readings_complete(self.get(day))
+
+    def scrape(self, day):
+        """Scrape one Sunday and keep it if it is at least as complete as what we (or another worker) had."""
+        readings = run_async(readings_extract_all_sections(get_readings_URL(day)))
+        if readings is not None:
+            with self._updating():
+                if readings_complete(readings) or not readings_complete(self.get(day)):
+                    self.entries[day] = {"readings": readings, "fetched_at": datetime.utcnow().isoformat()}
+        return self.get(day)
+
+    def mark_published(self, day):
+        with self._updating():
+            self._published = day
+
+    def prefetch(self, weeks=READINGS_PREFETCH_WEEKS):
+        """Scrape the following Sundays that are missing or incomplete; one prefetch at a time."""
+        if self._prefetching:
+            return
+        self._prefetching = True
+        try:
+            first = datetime.strptime(get_next_sunday(), "%Y-%m-%d").date()
+            for week in range(1, weeks + 1):
+                day = (first + timedelta(weeks=week)).strftime("%Y-%m-%d")
+                if not self.is_complete(day):
+                    logging.info(f"/fetch_readings prefetching {day}")
+                    self.scrape(day)
+        except Exception as e:
+            logging.info(f"/fetch_readings prefetch error {str(e)}")
+        finally:
+            self._prefetching = False
+
+
+readings_store = ReadingsStore()
+
+
+def in_quiet_hours():
+    hour = datetime.now(pytz.timezone("Europe/Paris")).hour
+    return READINGS_QUIET_HOURS[0] <= hour < READINGS_QUIET_HOURS[1]
+
 ##################################################################
 # MAIN FUNCTION TO FETCH READINGS
 
-def fetch_readings():
-    global z
-    url = get_current_readings_URL()
-    logging.info("/fetch_readings URL defined")
+def render_readings_html(day, readings):
+    if readings is None:
+        full_text = ''
+        logging.info("/fetch_readings content empty")
+    else:
+        full_text = '<P>' + french_date(day) + '</P?<BR>'
+        logging.info("/fetch_readings starting sections")
+        list_sections = ['1e lecture', 'Psaume', '2e lecture','Evangile']
+
+        for i, r in enumerate(readings[:4]):
+            logging.info("/fetch_readings processing section #%d" % i)
+            full_text += '<div class="sqs-block-content">'
+            full_text += f"<H3 class='sqs-block-title' style='color: rgb(55, 125, 197); margin-top: 2em; margin-bottom: 0.3em;'>{fix_encoding(list_sections[i])}</H3>\n"
+            full_text += f"<I>{fix_encoding(r['title'])}</I><BR>\n"
+            full_text += '<p>' + fix_encoding(r['text'])+'<BR></P>\n'
+            full_text += '</DIV>'
+    full_text += get_time_stamp_HTML()
+    return full_text
+
+
+def fetch_readings(force=False):
+    """
+    Publish the readings of the coming Sunday.
+    - already published and complete: answered from readings_<date>.html without any scrape
+    - complete in the store (e.g. prefetched): published without scraping
+    - otherwise (or force): scraped, stored and published
+    """
+    day = get_next_sunday()
+    store_path = READINGS_PATH_STORE % day
+    if not force and readings_store.published == day and readings_store.is_complete(day) \
+            and os.path.exists(store_path):
+        logging.info(f"/fetch_readings {day} served from cache")
+        with open(store_path, "r", encoding="utf-8") as f:
+            return f.read()
+
     try:
-        readings = asyncio.get_event_loop().run_until_complete(readings_extract_all_sections(url))
-        logging.info("/fetch_readings URL requested")
-        if readings is None:
-            full_text = ''
-            logging.info("/fetch_readings content empty")
+        if force or not readings_store.is_complete(day):
+            logging.info(f"/fetch_readings scraping {day}")
+            readings = readings_store.scrape(day)
         else:
-            logging.info("/fetch_readings content obtained")
-            z = readings
-            full_text = '<P>' + french_date(get_next_sunday()) + '</P?<BR>'
-            logging.info("/fetch_readings starting sections")
-            list_sections = ['1e lecture', 'Psaume', '2e lecture','Evangile']
-
-            for i, r in enumerate(readings[:4]):
-                logging.info("/fetch_readings processing section #%d" % i)
-                full_text += '<div class="sqs-block-content">'
-                full_text += f"<H3 class='sqs-block-title' style='color: rgb(55, 125, 197); margin-top: 2em; margin-bottom: 0.3em;'>{fix_encoding(list_sections[i])}</H3>\n"
-                full_text += f"<I>{fix_encoding(r['title'])}</I><BR>\n"
-                full_text += '<p>' + fix_encoding(r['text'])+'<BR></P>\n'
-                full_text += '</DIV>'
-        full_text += get_time_stamp_HTML()
-
+            logging.info(f"/fetch_readings {day} taken from the store")
+            readings = readings_store.get(day)
+        full_text = render_readings_html(day, readings)
     except Exception as e:
         logging.info("/fetch_readings error %s" % str(e))
         full_text = ''
     with open(READINGS_PATH_LAST, "w", encoding="utf-8") as f:
         f.write(full_text)
     logging.info(f"/fetch_readings local file written ({len(full_text)} length)")
-    push_b2_file(READINGS_PATH_LAST, 'lectures.html')
     logging.info(f"/fetch_readings local file size {os.path.getsize(READINGS_PATH_LAST)} bytes")
-    logging.info("/fetch_readings local file written uploaded to BB")
 
-    with open(READINGS_PATH_STORE % get_next_sunday(), "w", encoding="utf-8") as f:
+    with open(store_path, "w", encoding="utf-8") as f:
         f.write(full_text)
-    push_b2_file(READINGS_PATH_STORE % get_next_sunday(), 'historique_lectures_%s.html' % get_next_sunday())
+    file_index.touch(READINGS_PATH_LAST, store_path)
+    push_b2_files([
+        (READINGS_PATH_LAST, 'lectures.html'),
+        (store_path, 'historique_lectures_%s.html' % day),
+    ])
+    if readings_store.is_complete(day):
+        readings_store.mark_published(day)
+    logging.info("/fetch_readings local file written uploaded to BB")
     return full_text
 
 ##################################################################
@@ -647,78 +3135,151 @@ def fetch_readings():
 @app.route('/fetch_readings')
 def force_fetch_readings():
     logging.info("/fetch_readings called")
-    return fetch_readings()
+    return fetch_readings(force=request.args.get("force") == "1")
 
 ##################################################################
 # REGULAR CALL TO THE READINGS QUERY
 def periodic_query_readings():
-    while True:
-        fetch_readings()
-        time.sleep(1 * 60 * 60)  # Sleep 1 hours
+    fetch_readings()
+    if in_quiet_hours():
+        readings_store.prefetch()
+
+##################################################################
+# PERPLEXITY COMPLETIONS (CACHED, BUDGETED, MEASURED)
+PERPLEXITY_BASE_URL = os.getenv("PERPLEXITY_BASE_URL", "https://api.perplexity.ai")  # any OpenAI-compatible server
+PERPLEXITY_MODEL = os.getenv("PERPLEXITY_MODEL", "llama-3.1-sonar-large-128k-online")
+PERPLEXITY_CACHE_PATH = "perplexity_cache.json"
+PERPLEXITY_CACHE_DAYS = int(os.getenv("PERPLEXITY_CACHE_DAYS", "7"))  # entries older than this are dropped
+PERPLEXITY_STEP_TIMEOUT = float(os.getenv("PERPLEXITY_STEP_TIMEOUT", "60"))  # seconds per attempt
+PERPLEXITY_STEP_RETRIES = int(os.getenv("PERPLEXITY_STEP_RETRIES", "2"))
+
+
+class CompletionCache:
+    """
+    Chat completions persisted in perplexity_cache.json, keyed by SHA-256 of model + messages + day:
+    {key: {"day", "content", "usage": {"prompt_tokens", "completion_tokens", "total_tokens"}}}
+    The day is part of the key: the same conversation is asked again at most once a day.
+    """
+    def __init__(self, path=PERPLEXITY_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def key(model, messages, day):
+        payload = json.dumps({"model": model, "messages": messages, "day": day}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, day, content, usage):
+        oldest = (date.today() - timedelta(days=PERPLEXITY_CACHE_DAYS)).isoformat()
+        with self._lock:
+            self.entries = {k: e for k, e in self.entries.items() if e["day"] >= oldest}
+            self.entries[key] = {"day": day, "content": content, "usage": usage}
+            write_json_atomic(self.path, self.entries)
+
+
+completion_cache = CompletionCache()
+
+
+def perplexity_complete(client, step, messages, report, use_cache=True):
+    """
+    One chat completion with cache lookup, PERPLEXITY_STEP_TIMEOUT per attempt and PERPLEXITY_STEP_RETRIES retries.
+    Appends {"step", "cached", "attempts", "seconds", "prompt_tokens", "completion_tokens"} to report.
+    """
+    day = date.today().isoformat()
+    key = CompletionCache.key(PERPLEXITY_MODEL, messages, day)
+    start = time.perf_counter()
+    entry = completion_cache.get(key) if use_cache else None
+    attempts = 0
+    while entry is None:
+        attempts += 1
+        try:
+            with metrics.time("llm_call"):
+                response = client.chat.completions.create(model=PERPLEXITY_MODEL, messages=messages,
+                                                          timeout=PERPLEXITY_STEP_TIMEOUT)
+        except Exception as e:
+            logging.info(f"Perplexity query step {step} attempt {attempts} failed {str(e)}")
+            if attempts > PERPLEXITY_STEP_RETRIES:
+                raise
+            time.sleep(2 ** attempts)
+            continue
+        usage = response.usage
+        entry = {"content": response.choices[0].message.content, "usage": {
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            "total_tokens": getattr(usage, "total_tokens", 0) or 0,
+        }}
+        completion_cache.put(key, day, entry["content"], entry["usage"])
+    stats = {
+        "step": step,
+        "cached": attempts == 0,
+        "attempts": attempts,
+        "seconds": round(time.perf_counter() - start, 3),
+        # Tokens actually billed for this call (none when served from the cache)
+        "prompt_tokens": entry["usage"]["prompt_tokens"] if attempts else 0,
+        "completion_tokens": entry["usage"]["completion_tokens"] if attempts else 0,
+    }
+    report.append(stats)
+    metrics.inc("llm_requests_total", step=step, cached=str(stats["cached"]).lower())
+    metrics.inc("llm_tokens_total", stats["prompt_tokens"], step=step, kind="prompt")
+    metrics.inc("llm_tokens_total", stats["completion_tokens"], step=step, kind="completion")
+    logging.info(f"Perplexity query step {step} {stats}")
+    return entry["content"]
 
 ##################################################################
 # FUNCTION CALLING PERPLEXITY TO FIND NEARBY EVENTS
-def get_perplexity_events():
-    # Initialise the Perplexity connection
+def get_perplexity_events(use_cache=True, report=None):
+    """
+    Ask Perplexity for nearby events and publish the resulting HTML table.
+    - use_cache: reuse today's cached completions for identical conversations
+    - report: optional list filled with one stats dict per LLM step (see perplexity_complete)
+    """
+    report = [] if report is None else report
+    # Initialise the Perplexity connection (retries are handled per step)
     api_key = os.getenv("PERPLEXITY_KEY")
-    client = OpenAI(api_key=api_key, base_url="https://api.perplexity.ai")
+    client = OpenAI(api_key=api_key, base_url=PERPLEXITY_BASE_URL, max_retries=0)
 
     # 1 -- Base query
-    logging.info(f"Perplexity query step 1")
     query = "Pouvez-vous me donner la liste des événements religieux catholiques tels que pélerinages, processions, ou retraites organisés autour de Saint Malo ou du Mont Saint Michel, Saint Méloir des Ondes, l'abbaye de Beaufort (Plerguer) dans le mois à venir. Je souhaiterais au moins trois événements"
-    response = client.chat.completions.create(
-        model="llama-3.1-sonar-large-128k-online",  # Or another available Perplexity model
-        messages=[
-            {"role": "user", "content": query}
-        ]
-    )
-    history = [
-        {"role": "user", "content": query},
-        {"role": "assistant", "content": response.choices[0].message.content}
-    ]
+    history = [{"role": "user", "content": query}]
+    response = perplexity_complete(client, 1, history, report, use_cache)
+    history.append({"role": "assistant", "content": response})
 
     # 2 -- Add locations we like
-    logging.info(f"Perplexity query step 2")
     query_additions = ("Si il y a des événements religieux catholiques pertinents dans le mois à venir dans les abbayes suivantes, pouvez-vous les ajouter à ce que vous venez de me donner? \n"
         "- Monastère de Beaufort (https://www.monastere-beaufort.com/accueil.php)\n"
         "- Abbaye de Saint Jacut (https://www.abbaye-st-jacut.com/)\n"
         "- Abbaye du Mont Saint Michel\n")
     history.append({"role": "user", "content": query_additions})
-    response2 = client.chat.completions.create(
-        model="llama-3.1-sonar-large-128k-online",
-        messages=history
-    )
-    history.append({"role": "assistant", "content": response2.choices[0].message.content})
+    response2 = perplexity_complete(client, 2, history, report, use_cache)
+    history.append({"role": "assistant", "content": response2})
 
     # 3 -- Filter the results
-    logging.info(f"Perplexity query step 3")
-    results = response.choices[0].message.content+'\n\n'+response2.choices[0].message.content
+    results = response+'\n\n'+response2
     post_process_instruction = (
         "Voici les événements catholiques que vous avez trouvé:\n\n"
         f"{results}\n\n"
         "Veuillez filtrer cette liste pour n'inclure que les événements poru lesquels vous connaissez le lieu; pour lesquels le lieu est à moins de 100km de Saint Malo; et pour lesquels les dates sont disponibles "
     )
     history.append({"role": "user", "content": post_process_instruction})
-    post_process_response = client.chat.completions.create(
-        model="llama-3.1-sonar-large-128k-online",  # or your chosen model
-        messages=history
-    )
-    history.append({"role": "assistant", "content": post_process_response.choices[0].message.content})
+    results_filtered = perplexity_complete(client, 3, history, report, use_cache)
+    history.append({"role": "assistant", "content": results_filtered})
 
-    # 4 -- Formatting
-    logging.info(f"Perplexity query step 4")
-    results_filtered = post_process_response.choices[0]
+    # 4 -- Formatting (of the filtered list, not the raw results)
     formatting_instruction = (
         "Voici ce que vous avez trouvé:"
-        f"{results}\n\n"
+        f"{results_filtered}\n\n"
         "Donnez-moi s'il vous plaît une table HTML en français avec une ligne pour chaque événement, et des colonnes pour (a) Date; (b) Lieu; (c) Description; (d) lien URL (il doit uniquement apparaître le mot 'Cliquez ici'). N'incluez pas les citations / références"
     )
     history.append({"role": "user", "content": formatting_instruction})
-    formatted_response = client.chat.completions.create(
-        model="llama-3.1-sonar-large-128k-online",  # or your chosen model
-        messages=history
-    )
-    html_content = formatted_response.choices[0].message.content
+    html_content = perplexity_complete(client, 4, history, report, use_cache)
 
     # 5 - Only keep the HTML content
     logging.info(f"Perplexity query step 5")
@@ -737,10 +3298,15 @@ def get_perplexity_events():
     time_now = datetime.now()
     with open(PERPLEXITY_TIMESTAMP, 'w') as f:
         f.write(time_now.strftime("%Y-%m-%d %H:%M:%S"))
-    push_b2_file(PERPLEXITY_TABLE_LAST,"evenements.html")
-    push_b2_file(PERPLEXITY_TABLE_STORE % dt,"historique_evenements_%s.html" % dt)
-    push_b2_file(PERPLEXITY_TIMESTAMP,"evenements_MAJ.txt" % dt)
-    logging.info(f"Perplexity query done")
+    file_index.touch(PERPLEXITY_TABLE_LAST, PERPLEXITY_TABLE_STORE % dt, PERPLEXITY_TIMESTAMP)
+    push_b2_files([
+        (PERPLEXITY_TABLE_LAST, "evenements.html"),
+        (PERPLEXITY_TABLE_STORE % dt, "historique_evenements_%s.html" % dt),
+        (PERPLEXITY_TIMESTAMP, "evenements_MAJ.txt"),
+    ])
+    logging.info(f"Perplexity query done in {round(sum(r['seconds'] for r in report), 1)} s, "
+                 f"{sum(r['prompt_tokens'] + r['completion_tokens'] for r in report)} tokens, "
+                 f"{sum(r['cached'] for r in report)}/{len(report)} steps cached")
     return html_content
 
     #except Exception as e:
@@ -750,23 +3316,187 @@ def get_perplexity_events():
 # QUERY - FETCH PERPLEXITY
 @app.route('/fetch_perplexity')
 def force_fetch_perplexity():
+    # ?force=1 asks every step again instead of reusing today's cached completions
     logging.info("/fetch_perplexity called")
+    report = []
     try:
-        get_perplexity_events()
+        get_perplexity_events(use_cache=request.args.get("force") != "1", report=report)
     except Exception as e:
         logging.info(f"Perplexity step failed {str(e)}")
+        return jsonify({"status": "error", "error": str(e), "steps": report}), 502
+    return jsonify({"status": "ok", "steps": report})
 
 
 ##################################################################
-# MAIN LOOP
+# IN-PROCESS JOB SCHEDULER (ONE LEADER ACROSS GUNICORN WORKERS)
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+SCHEDULER_LOCK_PATH = "scheduler.lock"
+SCHEDULER_STATE_PATH = "scheduler_state.json"
+SCHEDULER_TICK = 30  # seconds between checks for due jobs / leadership
+SCHEDULER_JOBS = {
+    # name: (function, interval in seconds, max jitter in seconds)
+    "readings": (periodic_query_readings, 60 * 60, 5 * 60),
+    "schedule_refresh": (refresh_and_publish_schedule, int(os.getenv("SCHEDULE_REFRESH_INTERVAL", str(6 * 60 * 60))),
+                         10 * 60),
+    "perplexity_events": (get_perplexity_events, 24 * 60 * 60, 30 * 60),
+}
+
+
+class JobScheduler:
+    """
+    Runs SCHEDULER_JOBS in one background thread of exactly one worker process.
+    - leadership is an exclusive lockf (POSIX record lock) on scheduler.lock: released by the OS if
+      the leader dies, after which another worker takes over on its next tick. Unlike flock it is
+      not inherited by forked children, so an orphaned child cannot keep the leadership
+    - the leader never opens scheduler.lock a second time: closing any descriptor of the file
+      would drop its record lock
+    - next runs get a random jitter so jobs do not all start together
+    - a job whose next run passed while nobody was leader (restart, deploy) runs once on takeover
+    - state persisted in scheduler_state.json:
+      {job: {"last_run", "next_run", "last_status", "last_error", "last_duration", "durations", "runs"}}
+    """
+    def __init__(self, jobs=SCHEDULER_JOBS, lock_path=SCHEDULER_LOCK_PATH, state_path=SCHEDULER_STATE_PATH):
+        self.jobs = jobs
+        self.lock_path = lock_path
+        self.state_path = state_path
+        self._lock_file = None
+        self._thread = None
+        self.state = self._load()
+
+    def _load(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
 
-if __name__ == "__main__":
-    thread = threading.Thread(target=periodic_query_readings, daemon=True)
-    thread.start()
+    def _save(self):
+        write_json_atomic(self.state_path, self.state)
+
+    def is_leader(self):
+        return self._lock_file is not None
+
+    def _try_lead(self):
+        lock_file = open(self.lock_path, "a+")
+        try:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._lock_file = lock_file
+        # Take over the state written by the previous leader
+        self.state = self._load()
+        logging.info(f"Scheduler: process {os.getpid()} is now leader")
+        return True
+
+    def _run_job(self, name):
+        function, interval, jitter = self.jobs[name]
+        job_state = self.state.setdefault(name, {"runs": 0, "durations": []})
+        start = time.time()
+        logging.info(f"Scheduler: running {name}")
+        try:
+            function()
+            job_state.update(last_status="ok", last_error=None)
+        except Exception as e:
+            logging.info(f"Scheduler: {name} failed {str(e)}")
+            job_state.update(last_status="error", last_error=str(e))
+        duration = round(time.time() - start, 3)
+        job_state["runs"] += 1
+        job_state["last_run"] = start
+        job_state["last_duration"] = duration
+        job_state["durations"] = (job_state["durations"] + [duration])[-20:]
+        job_state["next_run"] = time.time() + interval + random.uniform(0, jitter)
+        self._save()
+
+    def _loop(self):
+        while True:
+            try:
+                if self.is_leader() or self._try_lead():
+                    now = time.time()
+                    for name in self.jobs:
+                        # Never run (or state lost): start soon but spread out; overdue: catch up once now
+                        next_run = self.state.get(name, {}).get("next_run")
+                        if next_run is None:
+                            next_run = now + random.uniform(0, self.jobs[name][2])
+                            self.state.setdefault(name, {"runs": 0, "durations": []})["next_run"] = next_run
+                            self._save()
+                        if next_run <= now:
+                            self._run_job(name)
+            except Exception as e:
+                logging.info(f"Scheduler loop error {str(e)}")
+            time.sleep(SCHEDULER_TICK)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True, name="scheduler")
+            self._thread.start()
+
+    def stats(self):
+        # Followers read what the leader persisted
+        if self.is_leader():
+            state, leader_pid = self.state, str(os.getpid())
+        else:
+            state = self._load()
+            try:
+                with open(self.lock_path, "r") as f:
+                    leader_pid = f.read().strip() or None
+            except OSError:
+                leader_pid = None
+        jobs = {}
+        for name, (_, interval, jitter) in self.jobs.items():
+            job_state = dict(state.get(name, {}))
+            durations = job_state.get("durations", [])
+            job_state.update(interval=interval, jitter=jitter,
+                             avg_duration=round(sum(durations) / len(durations), 3) if durations else None)
+            for field in ("last_run", "next_run"):
+                if job_state.get(field) is not None:
+                    job_state[field] = datetime.utcfromtimestamp(job_state[field]).isoformat()
+            jobs[name] = job_state
+        return {"enabled": SCHEDULER_ENABLED, "leader": self.is_leader(), "pid": os.getpid(),
+                "leader_pid": leader_pid, "jobs": jobs}
+
+
+job_scheduler = JobScheduler()
+if SCHEDULER_ENABLED and BACKGROUND_WORK:
+    job_scheduler.start()
+
+##################################################################
+# QUERY - SCHEDULER STATUS
+@app.route("/jobs/schedule")
+def show_job_schedule():
+    return jsonify(job_scheduler.stats())
+
+
+##################################################################
+# QUERY - METRICS (PROMETHEUS)
+def upload_folder_bytes():
+    return sum(size for _, size, _ in file_index.listing(UPLOAD_FOLDER + os.sep))
+
+
+metrics.gauge("upload_folder_bytes", "Total size of uploaded_files/", upload_folder_bytes)
+metrics.gauge("schedule_cache_hit_ratio", "Share of /schedule requests served from the cache (fresh or stale)",
+              lambda: schedule_cache.stats()["hit_rate"])
+metrics.gauge("schedule_cache_age_seconds", "Age of the cached mass schedule", schedule_cache.age)
+metrics.gauge("schedule_version", "Latest version of the schedule store (bumped by every change)",
+              schedule_store.version)
+metrics.gauge("browser_contexts_in_use", "Open Playwright contexts", lambda: browser_pool.in_use)
+metrics.gauge("async_engine_pending", "Coroutines queued or running on the async engine",
+              lambda: async_engine.pending)
+metrics.gauge("word_jobs_pending", "deliver_word jobs queued or running",
+              job_queue.pending)
 
-    app.run(host="0.0.0.0", port=10000)
 
+@app.route("/metrics")
+def show_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
-    while True:
-        schedule.run_pending()
-        time.sleep(60)
+
+##################################################################
+# MAIN LOOP
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=10000)